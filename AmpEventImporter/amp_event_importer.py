@@ -5,6 +5,7 @@
 This script is used to import Cisco AMP for Endpoints events into Cisco Command Center
 """
 
+import ipaddress
 import json
 import os
 import time
@@ -12,28 +13,88 @@ import time
 import pymongo
 import requests
 
+from bson.binary import Binary
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
 from requests.auth import HTTPBasicAuth
 
 load_dotenv()
 
 
 def get_events(start_date=None):
-    """Get AMP events from the specified start date."""
+    """Get AMP events from the specified start date, yielding the events on each page as it arrives."""
 
     # Format the date for AMP
     start_date = start_date.isoformat()
 
+    page_size = int(os.getenv("AMP_API_PAGE_SIZE", 500))
+
     # Build the API URL
     api_url = f"https://{os.getenv('AMP_API_FQDN')}/v1/events?start_date={start_date}" \
               f"&event_type[]=1090519054&event_type[]=553648147&event_type[]=553648168&event_type[]=1090519084"
 
+    # Get the first page of AMP Events, which reports the total number of events
+    response = get_page(f"{api_url}&limit={page_size}&offset=0")
+
+    yield from response["data"]
+
+    # A short first page holds all of the events
+    if len(response["data"]) < page_size:
+        return
+
+    total = response["metadata"]["results"].get("total")
+
+    # Once the total is known, fetch the rest of the pages concurrently, yielding them in order
+    if total is not None:
+        max_requests = int(os.getenv("AMP_API_MAX_CONCURRENT_REQUESTS", 4))
+        offset = page_size
+        pending_pages = deque()
+
+        with ThreadPoolExecutor(max_workers=max_requests) as executor:
+            while True:
+
+                # Keep a bounded number of pages in flight.  Events that arrive during the import push older events
+                # past the total, so keep going a page at a time past it until a page comes back short.
+                while len(pending_pages) < max_requests and (offset < total or not pending_pages):
+                    pending_pages.append(executor.submit(get_page, f"{api_url}&limit={page_size}&offset={offset}"))
+                    offset += page_size
+
+                events = pending_pages.popleft().result()["data"]
+
+                yield from events
+
+                if len(events) < page_size and offset >= total and not pending_pages:
+                    break
+
+    # Otherwise, follow the links to the next page
+    else:
+        while response["metadata"].get("links", {}).get("next"):
+            response = get_page(response["metadata"]["links"]["next"])
+
+            yield from response["data"]
+
+
+def get_page(api_url, retries=3):
+    """Get a page of AMP events, waiting and retrying when the AMP rate limit is reached."""
+
     print(f"Fetching {api_url}")
 
     # Get AMP Events
     http_request = requests.get(api_url, auth=HTTPBasicAuth(os.getenv("AMP_API_CLIENT_ID"), os.getenv("AMP_API_KEY")))
 
+    # Wait for the rate limit to reset, then try again
+    if http_request.status_code == 429 and retries:
+        wait_seconds = int(http_request.headers.get("Retry-After") or http_request.headers.get("X-RateLimit-Reset", 5))
+
+        print(f"AMP rate limit reached.  Retrying in {wait_seconds} seconds.")
+        time.sleep(wait_seconds)
+
+        return get_page(api_url, retries - 1)
+
     # Check to make sure the GET was successful
     if http_request.status_code == 200:
         return http_request.json()
@@ -42,9 +103,206 @@ def get_events(start_date=None):
         exit(1)
 
 
+# The size of each event rollup bucket, which must match the API Relay
+ROLLUP_BUCKET_MINUTES = 5
+
+# The fields the idempotency key of an AMP event is derived from
+EVENT_KEY_FIELDS = ["id"]
+
+# The error code MongoDB returns when a write violates a unique index
+DUPLICATE_KEY_ERROR = 11000
+
+
+def get_event_key(event):
+    """Get the idempotency key of an AMP event, which is its AMP event ID"""
+
+    return f"amp-{event['id']}"
+
+
+def get_rollup_key(event):
+    """Get the rollup key (bucket, product, event name and source IP) for an event"""
+
+    timestamp = event["timestamp"]
+    bucket = timestamp.replace(minute=timestamp.minute - timestamp.minute % ROLLUP_BUCKET_MINUTES,
+                               second=0, microsecond=0)
+
+    return (bucket, event["product"], event["event_name"], event["src_ip"])
+
+
+def get_ip_number(address):
+    """Convert an IP address into a number for range queries (an integer for IPv4, or binary for IPv6)"""
+
+    try:
+        address = ipaddress.ip_address(address)
+    except (TypeError, ValueError):
+        return None
+
+    return int(address) if address.version == 4 else Binary(address.packed)
+
+
+def update_rollups(rollup_table, rollup_counts):
+    """Apply a batch of event count changes to the event rollups"""
+
+    operations = []
+
+    for ((bucket, product, event_name, src_ip), count) in rollup_counts.items():
+
+        # Skip keys whose changes cancelled each other out
+        if not count:
+            continue
+
+        rollup_fields = {"bucket": bucket, "product": product, "event_name": event_name, "src_ip": src_ip}
+
+        operations.append(pymongo.UpdateOne({"_id": rollup_fields},
+                                            {"$inc": {"count": count},
+                                             "$setOnInsert": {**rollup_fields, "src_ip_num": get_ip_number(src_ip)}},
+                                            upsert=True))
+
+    if operations:
+        rollup_table.bulk_write(operations, ordered=False)
+
+
+def allocate_sequences(counter_table, count=1):
+    """Reserve a block of update sequence numbers, used by the API Relay to sync changes, and return the first"""
+
+    counter = counter_table.find_one_and_update({"_id": "events"}, {"$inc": {"seq": count}}, upsert=True,
+                                                return_document=pymongo.ReturnDocument.AFTER)
+
+    return counter["seq"] - count + 1
+
+
+def stamp_sequence(event, seq, insert_seq=None):
+    """Stamp an event with the update sequence of the write that stores it"""
+
+    event["insert_seq"] = seq if insert_seq is None else insert_seq
+    event["update_seq"] = seq
+    event["updated_at"] = datetime.utcnow()
+
+
+def ensure_indexes(event_table, state_table, source):
+    """Ensure the indexes used to find the latest event for a product, and events by their idempotency key, exist"""
+
+    # Matches the 'product_1_timestamp_-1' index managed by the API Relay
+    event_table.create_index([("product", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)],
+                             name="product_1_timestamp_-1")
+
+    # Matches the 'event_key_1' index managed by the API Relay.  Time series collections can't have unique indexes.
+    if os.getenv("EVENTS_STORAGE_MODE") == "timeseries":
+        event_table.create_index([("event_key", pymongo.ASCENDING)], name="event_key_1")
+    else:
+        event_table.create_index([("event_key", pymongo.ASCENDING)], name="event_key_1", unique=True,
+                                 partialFilterExpression={"event_key": {"$exists": True}})
+
+    # Key the events stored before the idempotency key existed, now that the unique index rejects duplicates.
+    # This scans all of the product's events, so it's only done once.
+    if not (state_table.find_one({"_id": source}) or {}).get("event_keys_backfilled"):
+        backfill_event_keys(event_table)
+        state_table.update_one({"_id": source}, {"$set": {"event_keys_backfilled": True}}, upsert=True)
+
+
+def backfill_event_keys(event_table):
+    """Add the idempotency key to the AMP events stored before it existed"""
+
+    legacy_events = event_table.find({"product": "AMP for Endpoints", "event_key": {"$exists": False}},
+                                     {field: 1 for field in EVENT_KEY_FIELDS})
+
+    operations = [pymongo.UpdateOne({"_id": event["_id"]}, {"$set": {"event_key": get_event_key(event)}})
+                  for event in legacy_events]
+
+    if not operations:
+        return
+
+    try:
+        result = event_table.bulk_write(operations, ordered=False)
+        print(f"Added the idempotency key to {result.modified_count} AMP events")
+
+    # Older duplicates of an event are left without a key, and expire with the rest of the old events
+    except BulkWriteError as error:
+        if any(write_error["code"] != DUPLICATE_KEY_ERROR for write_error in error.details["writeErrors"]):
+            raise
+
+        print(f"Added the idempotency key to {error.details['nModified']} AMP events, "
+              f"skipping {len(error.details['writeErrors'])} duplicates")
+
+
+def get_write_concern():
+    """Get the write concern for event imports, e.g. '1' to wait for the primary, or 'majority'"""
+
+    write_concern = os.getenv("IMPORT_WRITE_CONCERN", "1")
+
+    return WriteConcern(w=int(write_concern) if write_concern.isdigit() else write_concern)
+
+
+def store_events(event_table, counter_table, rollup_table, events):
+    """Store a batch of events with a single unordered insert, skipping the ones that are already stored.
+
+    Updates the event counts of the events stored, and returns the number stored.
+    """
+
+    # Time series collections can't have unique indexes, so leave out the events that are already stored instead
+    if os.getenv("EVENTS_STORAGE_MODE") == "timeseries":
+        stored_keys = set(event_table.distinct("event_key",
+                                               {"event_key": {"$in": [event["event_key"] for event in events]}}))
+        events = [event for event in events if event["event_key"] not in stored_keys]
+
+        if not events:
+            return 0
+
+    # Reserve a sequence number for each event in one round trip
+    first_seq = allocate_sequences(counter_table, len(events))
+
+    for (offset, event) in enumerate(events):
+        stamp_sequence(event, first_seq + offset)
+
+    try:
+        event_table.insert_many(events, ordered=False)
+        duplicates = set()
+
+    # The events re-fetched in the overlap window are already stored, so the unique index rejects them
+    except BulkWriteError as error:
+        if any(write_error["code"] != DUPLICATE_KEY_ERROR for write_error in error.details["writeErrors"]):
+            raise
+
+        duplicates = {write_error["index"] for write_error in error.details["writeErrors"]}
+
+    stored_events = [event for (index, event) in enumerate(events) if index not in duplicates]
+
+    update_rollups(rollup_table, Counter(get_rollup_key(event) for event in stored_events))
+
+    print(f"Stored a batch of {len(stored_events)} AMP events, skipping {len(duplicates)} already stored")
+
+    return len(stored_events)
+
+
+def get_checkpoint(state_table, event_table, source):
+    """Get the importer checkpoint for a source, seeding its watermark from the latest stored event the first time"""
+
+    checkpoint = state_table.find_one({"_id": source})
+
+    if checkpoint and "watermark" in checkpoint:
+        return checkpoint
+
+    # Before checkpoints were stored, the importers resumed from the latest stored event
+    latest_event = event_table.find_one({"product": source}, sort=[("timestamp", pymongo.DESCENDING)])
+
+    return {"_id": source, "watermark": latest_event["timestamp"] if latest_event else None}
+
+
+def save_checkpoint(state_table, source, watermark, run_stats):
+    """Save the watermark and statistics of an import run in a single atomic update"""
+
+    state_table.update_one({"_id": source},
+                           {"$max": {"watermark": watermark},
+                            "$set": {"last_run": run_stats, "updated_at": datetime.utcnow()},
+                            "$inc": {"total_inserted": run_stats["inserted"], "total_updated": run_stats["updated"]}},
+                           upsert=True)
+
+
 def run():
     """Main function to get new AMP events and commit them to the MongoDB database"""
 
+    run_started_at = datetime.utcnow()
+
     # Connect to the MongoDB instance
     db_client = pymongo.MongoClient(f"mongodb://{os.getenv('MONGO_INITDB_ADDRESS')}/",
                                     username=os.getenv("MONGO_INITDB_ROOT_USERNAME"),
@@ -53,30 +311,51 @@ def run():
     # Use the specified database
     command_center_db = db_client[os.getenv("MONGO_INITDB_DATABASE")]
 
-    # Use the 'events' collection from the specified database
-    command_center_events = command_center_db["events"]
+    # Use the 'events' collection from the specified database, with the configured write concern
+    command_center_events = command_center_db["events"].with_options(write_concern=get_write_concern())
 
-    # Get the count of AMP for Endpoints documents
-    event_count = command_center_events.count_documents({"product": "AMP for Endpoints"})
+    # Use the 'event_rollups' collection to keep event counts up to date
+    command_center_rollups = command_center_db["event_rollups"]
 
-    # If we have previous events, import from that point in time, otherwise, import the last 30 days
-    if event_count:
+    # Use the 'counters' collection to allocate update sequences
+    command_center_counters = command_center_db["counters"]
 
-        # Get the latest 'AMP for Endpoints' event
-        latest_event = command_center_events.find({"product": "AMP for Endpoints"}).sort("timestamp", -1)
-        latest_event = latest_event[0]
+    # Use the 'importer_state' collection to keep track of where each import left off
+    command_center_importer_state = command_center_db["importer_state"]
+
+    # Make sure the latest event lookup is an index scan
+    ensure_indexes(command_center_events, command_center_importer_state, "AMP for Endpoints")
+
+    # Get the checkpoint of the last import
+    checkpoint = get_checkpoint(command_center_importer_state, command_center_events, "AMP for Endpoints")
+
+    # If we have imported events before, import from that point in time, otherwise, import the last 30 days
+    if checkpoint["watermark"]:
+        # Re-fetch a window before the watermark, since the events that are already stored are skipped
+        overlap = timedelta(seconds=int(os.getenv("IMPORT_OVERLAP_SECONDS", 300)))
+        latest_event = {"timestamp": checkpoint["watermark"] - overlap}
     else:
         print("No events in database.  Setting latest_event timestamp to 30 days ago.")
         start_date = datetime.utcnow().replace(microsecond=0) + timedelta(-30)
         latest_event = {"timestamp": start_date}
 
-    print("Latest AMP Event: ", latest_event["timestamp"])
+    print("Importing AMP events from: ", latest_event["timestamp"])
 
-    # Get the latest AMP events
+    # Get the latest AMP events, which are stored as the pages arrive
     amp_events = get_events(latest_event["timestamp"])
 
+    # Events are stored in batches, rather than one at a time
+    batch_size = int(os.getenv("IMPORT_BATCH_SIZE", 1000))
+    batch = []
+
+    # Keep track of the newest event imported, and the number of events
+    newest_event_time = None
+    run_stats = {"started_at": run_started_at, "fetched": 0, "inserted": 0, "updated": 0}
+
     # Iterate through all fetched events
-    for event in amp_events["data"]:
+    for event in amp_events:
+
+        run_stats["fetched"] += 1
 
         current_event_time = datetime.strptime(event["date"], "%Y-%m-%dT%H:%M:%S+00:00")
         latest_event_time = latest_event["timestamp"]
@@ -93,7 +372,7 @@ def run():
         if not src_ip:
             src_ip = event["computer"]["external_ip"]
 
-        if current_event_time > latest_event_time:
+        if current_event_time >= latest_event_time:
 
             # Make common fields for the event
             event_common_fields = {
@@ -108,10 +387,34 @@ def run():
             # Add the common fields to the event
             event.update(event_common_fields)
 
-            # Store the event in the database
-            x = command_center_events.insert_one(event)
+            # Store the source IP as a number too, for CIDR range queries
+            event["src_ip_num"] = get_ip_number(event["src_ip"])
+
+            # Time series collections group events into buckets by their 'meta' field
+            if os.getenv("EVENTS_STORAGE_MODE") == "timeseries":
+                event["meta"] = {"product": event["product"], "src_ip": event["src_ip"]}
+
+            # Key the event by its source, so that it's only stored once however many times it's fetched
+            event["event_key"] = get_event_key(event)
+
+            batch.append(event)
+
+            newest_event_time = max(newest_event_time or current_event_time, current_event_time)
+
+            # Store the batch once it's full
+            if len(batch) >= batch_size:
+                run_stats["inserted"] += store_events(command_center_events, command_center_counters,
+                                                      command_center_rollups, batch)
+                batch = []
+
+    # Store the rest of the events
+    if batch:
+        run_stats["inserted"] += store_events(command_center_events, command_center_counters,
+                                              command_center_rollups, batch)
 
-            print(x.inserted_id)
+    # Move the watermark up to the newest event, now that the events are stored
+    run_stats["finished_at"] = datetime.utcnow()
+    save_checkpoint(command_center_importer_state, "AMP for Endpoints", newest_event_time, run_stats)
 
 
 if __name__ == "__main__":
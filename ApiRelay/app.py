@@ -7,23 +7,56 @@ This script runs a FastAPI web server which handles the API (/api) requests for
 event data, and interactions with security products.
 """
 
+import asyncio
 import os
 import pprint
 import uvicorn
 
 import config
+import database
 
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from products.cisco_amp import cisco_amp
 from products.cisco_ise import cisco_ise
 from products.cisco_stealthwatch import cisco_stealthwatch
-from products.command_center import command_center
+from products.command_center import addresses, command_center, guardrails, index_manager, rollups, storage
+from pymongo.errors import ExecutionTimeout, PyMongoError
 
 # Instantiate FastAPI
 app = FastAPI(
     title="Command Center API Relay",
     version="0.1"
 )
+
+
+@app.on_event("startup")
+async def startup_db_client():
+    """Create the shared MongoDB client when the application starts."""
+
+    app.state.db_client = database.connect()
+
+    # Prepare the database in the background so that startup isn't blocked on it
+    app.state.prepare_database_task = asyncio.ensure_future(_prepare_database())
+
+
+@app.on_event("shutdown")
+def shutdown_db_client():
+    """Close the shared MongoDB client when the application shuts down."""
+
+    app.state.prepare_database_task.cancel()
+    command_center.event_broadcaster.stop()
+    app.state.db_client.close()
+
+
+@app.exception_handler(ExecutionTimeout)
+async def query_timeout_handler(request, error):
+    """Tell the client to narrow its query when it runs out of time, rather than failing with a server error."""
+
+    return JSONResponse(status_code=503,
+                        content={'detail': "The query took too long.  Try a shorter timeframe or more filters."})
+
+
 app.include_router(cisco_amp.router, prefix="/amp", tags=["Cisco AMP"])
 app.include_router(cisco_ise.router, prefix="/ise", tags=["Cisco ISE"])
 app.include_router(cisco_stealthwatch.router, prefix="/stealthwatch", tags=["Cisco Stealthwatch"])
@@ -37,6 +70,41 @@ async def ping_pong():
     return {'pong!'}
 
 
+async def _prepare_database():
+    """Ensure the Command Center collections have the indexes their queries need, and that rollups exist."""
+
+    command_center_db = app.state.db_client[config.MONGO_DATABASE]
+
+    try:
+        # Create the events collection up front if it's a time series collection
+        await storage.ensure_collection(command_center_db, config.EVENTS_STORAGE_MODE)
+
+        index_names = await index_manager.ensure_indexes(command_center_db["events"],
+                                                         storage.get_event_indexes(config.EVENTS_STORAGE_MODE))
+        print(f"Ensured indexes on 'events': {', '.join(index_names)}")
+
+        # Only hint the indexes that were actually built
+        index_names = await guardrails.refresh_available_indexes(command_center_db["events"])
+        print(f"Hinting indexes on 'events': {', '.join(sorted(index_names))}")
+
+        index_names = await index_manager.ensure_indexes(command_center_db["event_rollups"], rollups.ROLLUP_INDEXES)
+        print(f"Ensured indexes on 'event_rollups': {', '.join(index_names)}")
+
+        # If there are events stored before their source IPs were stored as numbers, then convert them.  This has
+        # to come before the rollups are backfilled, since they copy 'src_ip_num' from the events.
+        if await command_center_db["events"].find_one({"src_ip_num": {"$exists": False}}, {"_id": 1}):
+            print("Backfilling 'src_ip_num' on 'events' and 'event_rollups'...")
+            print(f"Updated {await addresses.backfill(command_center_db)} documents")
+
+        # If the rollups haven't been built from the events yet, then build them
+        if not await rollups.is_backfilled(command_center_db):
+            print("Backfilling 'event_rollups' from 'events'...")
+            await rollups.backfill(command_center_db)
+
+    except PyMongoError as error:
+        print(f"Unable to prepare the database: {error}")
+
+
 def _get_config_mongodb():
     """This will get configuration data from a MongoDB instance."""
 
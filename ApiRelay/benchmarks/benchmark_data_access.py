@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python script to compare synchronous (pymongo) and asynchronous (Motor) event queries.
+
+Both modes run the same first-page events query, with the same number of requests in flight at once.  The
+synchronous mode runs them on a threadpool, the way Starlette runs 'def' endpoints, and the asynchronous mode
+multiplexes them on the event loop, the way it runs 'async def' endpoints.
+
+Run it from the ApiRelay directory, against a populated database, e.g.:
+
+    python -m benchmarks.benchmark_data_access --concurrency 100 --requests 2000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import pymongo
+
+import config
+import database
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from products.command_center import pagination
+
+
+def _query_filter(timeframe):
+    """Build the same filter that GET /command-center/events uses for a timeframe."""
+
+    return {"timestamp": {"$gte": datetime.utcnow().replace(microsecond=0) - timedelta(hours=timeframe)}}
+
+
+def run_sync(concurrency, requests, timeframe, limit):
+    """Run the events query with pymongo on a threadpool, and return the latency of each request."""
+
+    db_client = pymongo.MongoClient(f"mongodb://{config.MONGO_ADDRESS}/",
+                                    username=config.MONGO_USERNAME,
+                                    password=config.MONGO_PASSWORD,
+                                    maxPoolSize=config.MONGO_MAX_POOL_SIZE,
+                                    minPoolSize=config.MONGO_MIN_POOL_SIZE,
+                                    connectTimeoutMS=config.MONGO_CONNECT_TIMEOUT_MS,
+                                    serverSelectionTimeoutMS=config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                                    socketTimeoutMS=config.MONGO_SOCKET_TIMEOUT_MS)
+
+    command_center_events = db_client[config.MONGO_DATABASE]["events"]
+
+    def query():
+        started = time.perf_counter()
+        list(command_center_events.find(_query_filter(timeframe)).sort(pagination.SORT_ORDER).limit(limit))
+        return time.perf_counter() - started
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(lambda _: query(), range(requests)))
+    finally:
+        db_client.close()
+
+
+async def run_async(concurrency, requests, timeframe, limit):
+    """Run the events query with Motor on the event loop, and return the latency of each request."""
+
+    db_client = database.connect()
+
+    command_center_events = db_client[config.MONGO_DATABASE]["events"]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def query():
+        async with semaphore:
+            started = time.perf_counter()
+            await (command_center_events.find(_query_filter(timeframe))
+                                        .sort(pagination.SORT_ORDER)
+                                        .limit(limit)
+                                        .to_list(length=None))
+            return time.perf_counter() - started
+
+    try:
+        return await asyncio.gather(*[query() for _ in range(requests)])
+    finally:
+        db_client.close()
+
+
+def report(mode, latencies, elapsed):
+    """Print the throughput and latency percentiles of a run."""
+
+    percentiles = statistics.quantiles(latencies, n=100)
+
+    print(f"{mode:>5}: {len(latencies) / elapsed:8.1f} req/s  "
+          f"p50 {percentiles[49] * 1000:7.1f} ms  "
+          f"p95 {percentiles[94] * 1000:7.1f} ms  "
+          f"p99 {percentiles[98] * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=40, help="Requests in flight at once")
+    parser.add_argument("--requests", type=int, default=1000, help="Total requests per mode")
+    parser.add_argument("--timeframe", type=int, default=24, help="Timeframe to query, in hours")
+    parser.add_argument("--limit", type=int, default=config.EVENTS_DEFAULT_PAGE_SIZE, help="Events per page")
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests, {args.concurrency} in flight, {args.timeframe} hour timeframe, "
+          f"{args.limit} events per page")
+
+    started = time.perf_counter()
+    latencies = run_sync(args.concurrency, args.requests, args.timeframe, args.limit)
+    report("sync", latencies, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    latencies = asyncio.run(run_async(args.concurrency, args.requests, args.timeframe, args.limit))
+    report("async", latencies, time.perf_counter() - started)
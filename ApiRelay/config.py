@@ -9,3 +9,52 @@ import os
 from dotenv import load_dotenv
 
 load_dotenv()
+
+# MongoDB connection parameters
+MONGO_ADDRESS = os.getenv("MONGO_INITDB_ADDRESS")
+MONGO_DATABASE = os.getenv("MONGO_INITDB_DATABASE", "commandcenter")
+MONGO_USERNAME = os.getenv("MONGO_INITDB_ROOT_USERNAME")
+MONGO_PASSWORD = os.getenv("MONGO_INITDB_ROOT_PASSWORD")
+
+# MongoDB connection pool parameters
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 30000))
+
+# Command Center event storage mode, either 'standard' or 'timeseries' (MongoDB 7.0 or later)
+EVENTS_STORAGE_MODE = os.getenv("EVENTS_STORAGE_MODE", "standard")
+
+# Command Center event paging parameters
+EVENTS_DEFAULT_PAGE_SIZE = int(os.getenv("EVENTS_DEFAULT_PAGE_SIZE", 500))
+EVENTS_MAX_PAGE_SIZE = int(os.getenv("EVENTS_MAX_PAGE_SIZE", 5000))
+EVENTS_STREAM_BATCH_SIZE = int(os.getenv("EVENTS_STREAM_BATCH_SIZE", 1000))
+
+# Command Center response cache parameters
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 256))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 5))
+RESPONSE_CACHE_STALE_SECONDS = float(os.getenv("RESPONSE_CACHE_STALE_SECONDS", 30))
+RESPONSE_CACHE_WATERMARK_INTERVAL_SECONDS = float(os.getenv("RESPONSE_CACHE_WATERMARK_INTERVAL_SECONDS", 1))
+
+# Command Center live event parameters
+LIVE_EVENTS_QUEUE_SIZE = int(os.getenv("LIVE_EVENTS_QUEUE_SIZE", 1000))
+LIVE_EVENTS_POLL_INTERVAL_SECONDS = float(os.getenv("LIVE_EVENTS_POLL_INTERVAL_SECONDS", 2))
+LIVE_EVENTS_KEEPALIVE_SECONDS = float(os.getenv("LIVE_EVENTS_KEEPALIVE_SECONDS", 15))
+
+# Command Center sync parameters
+SYNC_SETTLE_SECONDS = float(os.getenv("SYNC_SETTLE_SECONDS", 10))
+
+# Command Center query guardrails: time budgets, index hints, the streamed event cap and the slow query log
+QUERY_MAX_TIME_MS = int(os.getenv("QUERY_MAX_TIME_MS", 5000))
+QUERY_AGGREGATE_MAX_TIME_MS = int(os.getenv("QUERY_AGGREGATE_MAX_TIME_MS", 15000))
+QUERY_STREAM_MAX_TIME_MS = int(os.getenv("QUERY_STREAM_MAX_TIME_MS", 60000))
+QUERY_HINTS_ENABLED = os.getenv("QUERY_HINTS_ENABLED", "true").lower() == "true"
+EVENTS_STREAM_MAX_DOCUMENTS = int(os.getenv("EVENTS_STREAM_MAX_DOCUMENTS", 100000))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 500))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", 100))
+
+# Command Center event cache and batch lookup parameters
+EVENT_CACHE_MAX_ENTRIES = int(os.getenv("EVENT_CACHE_MAX_ENTRIES", 1024))
+EVENT_CACHE_MUTABLE_TTL_SECONDS = float(os.getenv("EVENT_CACHE_MUTABLE_TTL_SECONDS", 30))
+EVENTS_BATCH_MAX_IDS = int(os.getenv("EVENTS_BATCH_MAX_IDS", 500))
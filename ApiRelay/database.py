@@ -0,0 +1,33 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to manage the API Relay's connection to MongoDB.
+
+A single pooled Motor client is created when the application starts and closed when it shuts down.  Routers
+receive the database through the get_database dependency rather than connecting on every request.
+"""
+
+import config
+
+from fastapi import Request
+from motor.motor_asyncio import AsyncIOMotorClient
+
+
+def connect():
+    """Create a pooled, asynchronous MongoDB client using the configured connection parameters."""
+
+    return AsyncIOMotorClient(f"mongodb://{config.MONGO_ADDRESS}/",
+                              username=config.MONGO_USERNAME,
+                              password=config.MONGO_PASSWORD,
+                              maxPoolSize=config.MONGO_MAX_POOL_SIZE,
+                              minPoolSize=config.MONGO_MIN_POOL_SIZE,
+                              connectTimeoutMS=config.MONGO_CONNECT_TIMEOUT_MS,
+                              serverSelectionTimeoutMS=config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                              socketTimeoutMS=config.MONGO_SOCKET_TIMEOUT_MS)
+
+
+def get_database(request: Request):
+    """A dependency that returns the Command Center database from the application's shared client."""
+
+    return request.app.state.db_client[config.MONGO_DATABASE]
+
@@ -0,0 +1,35 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python script to store the source IPs of existing Command Center events and rollups as numbers.
+
+Events imported before 'src_ip_num' was added can't be matched by CIDR filters until it's set.  The API Relay
+runs this backfill when it starts, if it finds an event without 'src_ip_num', and it can be run by hand from the
+ApiRelay directory, e.g.:
+
+    python -m migrations.backfill_ip_numbers
+"""
+
+import asyncio
+
+import config
+import database
+
+from products.command_center import addresses
+
+
+async def backfill():
+    """Set 'src_ip_num' on every event and rollup that doesn't have it."""
+
+    db_client = database.connect()
+
+    try:
+        updated = await addresses.backfill(db_client[config.MONGO_DATABASE])
+        print(f"Updated {updated} documents")
+
+    finally:
+        db_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill())
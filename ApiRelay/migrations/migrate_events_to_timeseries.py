@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python script to migrate the Command Center events into a MongoDB time series collection.
+
+The existing 'events' collection is renamed to 'events_legacy', a time series collection is created in its place,
+the events are copied into it, and its indexes are created.  The legacy collection is kept, so that it can be
+checked and dropped by hand afterwards.  Set EVENTS_STORAGE_MODE=timeseries for every container once it's done.
+
+Stop the importers first, then run it from the ApiRelay directory, e.g.:
+
+    python -m migrations.migrate_events_to_timeseries --batch-size 1000
+"""
+
+import argparse
+import asyncio
+
+import config
+import database
+
+from products.command_center import index_manager, storage
+
+
+async def migrate(batch_size):
+    """Migrate the events collection, and create the indexes it needs."""
+
+    db_client = database.connect()
+
+    command_center_db = db_client[config.MONGO_DATABASE]
+
+    try:
+        copied = await storage.migrate_to_timeseries(command_center_db, batch_size=batch_size)
+        print(f"Copied {copied} events into the 'events' time series collection")
+
+        index_names = await index_manager.ensure_indexes(command_center_db["events"],
+                                                         storage.get_event_indexes(storage.TIMESERIES))
+        print(f"Ensured indexes on 'events': {', '.join(index_names)}")
+
+    finally:
+        db_client.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000, help="Events copied per insert")
+    args = parser.parse_args()
+
+    asyncio.run(migrate(args.batch_size))
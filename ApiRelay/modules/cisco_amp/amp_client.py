@@ -13,6 +13,8 @@ import json
 
 import requests
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from requests.auth import HTTPBasicAuth
 
 
@@ -25,15 +27,20 @@ class AmpClient(object):
     __amp_client_id = None
     __amp_api_key = None
 
+    __max_workers = 4
+
     __debug = False
 
-    def __init__(self, fqdn="api.amp.cisco.com", client_id=None, api_key=None, debug=False):
+    def __init__(self, fqdn="api.amp.cisco.com", client_id=None, api_key=None, max_workers=4, debug=False):
         """Initializes the AmpClient object."""
 
         self.__amp_fqdn = fqdn
         self.__amp_client_id = client_id
         self.__amp_api_key = api_key
 
+        # The most pages of paginated data to fetch at once
+        self.__max_workers = max_workers
+
         self.__debug = debug
 
     def get_computers(self, internal_ip=None, external_ip=None, group_guids=[], hostnames=[]):
@@ -290,35 +297,62 @@ class AmpClient(object):
 
         return response
 
-    def _get_paginated_data(self, url=None, limit=10, offset=0):
-        """Performs an HTTP GET request that returns all paginated data."""
+    def _get_paginated_data(self, url=None, limit=500, offset=0):
+        """Performs HTTP GET requests that return all paginated data."""
+
+        return [item for page in self._iter_paginated_data(url, limit, offset) for item in page]
+
+    def _iter_paginated_data(self, url=None, limit=500, offset=0):
+        """Performs HTTP GET requests for paginated data, yielding the data a page at a time."""
+
+        # Get the first page, which reports the total number of results
+        response = self._get_request(url + "&limit={}&offset={}".format(limit, offset))
+
+        if not response:
+            return
 
-        # A placeholder for looping
-        returned_results = limit
+        yield response["data"]
 
-        # A placeholder for return data
-        return_data = []
+        # A short first page holds all of the data
+        if len(response["data"]) < limit:
+            return
 
-        # Loop through requests
-        while returned_results == limit:
+        total = response["metadata"]["results"].get("total")
 
-            # Build the API URL
-            paginated_url = url + "&limit={}&offset={}".format(limit, offset)
+        # Once the total is known, fetch the rest of the pages concurrently, yielding them in order
+        if total is not None:
+            page_offset = offset + limit
+            pending_pages = deque()
 
-            # Send the GET request
-            response = self._get_request(paginated_url)
+            with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+                while True:
 
-            # Append all data to the return data
-            for item in response["data"]:
-                return_data.append(item)
+                    # Keep a bounded number of pages in flight, and go a page at a time past the total, which may
+                    # have grown since the first page, until a page comes back short
+                    while len(pending_pages) < self.__max_workers and (page_offset < total or not pending_pages):
+                        pending_pages.append(executor.submit(self._get_request,
+                                                             url + "&limit={}&offset={}".format(limit, page_offset)))
+                        page_offset += limit
 
-            # Update the number of returned results
-            returned_results = response['metadata']['results']['current_item_count']
+                    response = pending_pages.popleft().result()
+
+                    if not response:
+                        return
+
+                    yield response["data"]
+
+                    if len(response["data"]) < limit and page_offset >= total and not pending_pages:
+                        return
+
+        # Otherwise, follow the links to the next page
+        else:
+            while response["metadata"].get("links", {}).get("next"):
+                response = self._get_request(response["metadata"]["links"]["next"])
 
-            # Increment the offset
-            offset += limit
+                if not response:
+                    return
 
-        return return_data
+                yield response["data"]
 
     def _delete_request(self, url=None, data=None):
         """Performs an HTTP DELETE request."""
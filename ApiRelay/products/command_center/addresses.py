@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to query Command Center events by source IP range.
+
+The importers store each event's source IP as a number in 'src_ip_num', alongside the 'src_ip' string: IPv4
+addresses as integers, and IPv6 addresses as 16 byte binary values, which MongoDB compares byte by byte.  Since
+the two are different BSON types, a range of one never matches the other, so a CIDR block becomes a single
+indexed range scan.
+"""
+
+import ipaddress
+
+from bson.binary import Binary
+
+
+class InvalidCidr(ValueError):
+    """Raised when a client supplied CIDR block can't be parsed."""
+
+
+def to_ip_number(address):
+    """Convert an IP address into the number stored in 'src_ip_num', or None if it isn't an IP address."""
+
+    try:
+        return _encode(ipaddress.ip_address(address))
+    except (TypeError, ValueError):
+        return None
+
+
+def cidr_filter(cidr):
+    """Build a query filter for the events with a source IP in a CIDR block, e.g. '10.20.0.0/16'."""
+
+    try:
+        network = ipaddress.ip_network(cidr.strip(), strict=False)
+    except ValueError:
+        raise InvalidCidr(f"Invalid CIDR block: {cidr}")
+
+    return {"src_ip_num": {"$gte": _encode(network.network_address), "$lte": _encode(network.broadcast_address)}}
+
+
+async def backfill(command_center_db, collection_names=("events", "event_rollups")):
+    """Set 'src_ip_num' on the documents stored before it was added, and return the number updated.
+
+    The documents are updated a source IP at a time, so that each IP address is only converted once.
+    """
+
+    updated = 0
+
+    for collection_name in collection_names:
+        collection = command_center_db[collection_name]
+
+        for src_ip in await collection.distinct("src_ip", {"src_ip_num": {"$exists": False}}):
+            result = await collection.update_many({"src_ip": src_ip, "src_ip_num": {"$exists": False}},
+                                                  {"$set": {"src_ip_num": to_ip_number(src_ip)}})
+
+            updated += result.modified_count
+
+    return updated
+
+
+def _encode(address):
+    """Encode an ipaddress address as an integer for IPv4, or binary for IPv6."""
+
+    if address.version == 4:
+        return int(address)
+
+    return Binary(address.packed)
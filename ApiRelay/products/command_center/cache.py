@@ -0,0 +1,193 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to cache Command Center responses in process.
+
+Dashboards poll the same endpoints with the same parameters, so responses are cached for a short TTL, keyed by
+the normalized request parameters.  Once an entry is past its TTL it's still served while it's refreshed in the
+background, until it's too stale to serve.  Concurrent requests for the same key share a single computation, and
+the whole cache is invalidated whenever a newer event is observed in the database.
+
+Individual event documents are cached separately by ID.  Events are only ever inserted, except for Stealthwatch
+events, which are replaced as they're updated, so those are cached with the update sequence they were fetched at,
+to be checked against the database before they're served, and only for a short TTL.
+"""
+
+import asyncio
+import time
+
+from collections import OrderedDict, namedtuple
+
+CacheEntry = namedtuple("CacheEntry", ["value", "created", "watermark"])
+
+# The products whose events are updated after they're imported
+MUTABLE_PRODUCTS = ["Stealthwatch"]
+
+
+class ResponseCache(object):
+    """A size bounded LRU cache with a TTL, stale-while-revalidate and request coalescing."""
+
+    def __init__(self, max_entries=256, ttl=5, stale_ttl=30, watermark_interval=1):
+        """Initializes the ResponseCache object.  Times are in seconds."""
+
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._stale_ttl = stale_ttl
+        self._watermark_interval = watermark_interval
+
+        self._entries = OrderedDict()
+        self._pending = {}
+
+        self._watermark = None
+        self._watermark_checked = None
+
+    async def get(self, key, compute, get_watermark):
+        """Get the cached value for a key, computing it with the 'compute' coroutine function if needed.
+
+        The 'get_watermark' coroutine function is called at most once per watermark interval to find the newest
+        event in the database, and the cache is cleared if it has changed.
+        """
+
+        watermark = await self._observe_watermark(get_watermark)
+
+        entry = self._entries.get(key)
+
+        if entry and entry.watermark == watermark:
+            age = time.monotonic() - entry.created
+
+            # Serve fresh entries as they are, and stale entries while they're refreshed in the background
+            if age < self._stale_ttl:
+                self._entries.move_to_end(key)
+
+                if age >= self._ttl:
+                    self._start_computation(key, compute, watermark)
+
+                return entry.value
+
+        # Join a computation that's already in flight for this key, or start one.  The computation is shielded so
+        # that a client disconnecting doesn't cancel it for everyone else waiting on it.
+        return await asyncio.shield(self._start_computation(key, compute, watermark))
+
+    def clear(self):
+        """Remove every entry from the cache."""
+
+        self._entries.clear()
+
+    def _start_computation(self, key, compute, watermark):
+        """Start computing a value for a key, unless it's already being computed."""
+
+        pending = self._pending.get((key, watermark))
+
+        if pending is None:
+            pending = self._pending[(key, watermark)] = asyncio.ensure_future(self._compute(key, compute, watermark))
+
+            # Retrieve the result, so that failed background refreshes aren't reported as unhandled
+            pending.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+        return pending
+
+    async def _compute(self, key, compute, watermark):
+        """Compute a value and store it."""
+
+        try:
+            value = await compute()
+
+            self._entries[key] = CacheEntry(value, time.monotonic(), watermark)
+            self._entries.move_to_end(key)
+
+            # Evict the least recently used entries
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+            return value
+
+        finally:
+            self._pending.pop((key, watermark), None)
+
+    async def _observe_watermark(self, get_watermark):
+        """Get the current watermark, checking the database at most once per watermark interval."""
+
+        now = time.monotonic()
+
+        if self._watermark_checked is not None and now - self._watermark_checked < self._watermark_interval:
+            return self._watermark
+
+        # Mark the check as done up front, so that concurrent requests don't all check the database
+        self._watermark_checked = now
+
+        watermark = await get_watermark()
+
+        # If there's a newer event, then every cached response is out of date
+        if watermark != self._watermark:
+            self._entries.clear()
+            self._watermark = watermark
+
+        return watermark
+
+
+class EventCache(object):
+    """A size bounded LRU cache of event documents by ID.  Events that can be updated expire after a TTL."""
+
+    def __init__(self, max_entries=1024, mutable_ttl=30):
+        """Initializes the EventCache object.  Times are in seconds."""
+
+        self._max_entries = max_entries
+        self._mutable_ttl = mutable_ttl
+
+        self._entries = OrderedDict()
+
+    def get(self, event_id):
+        """Get a cached event by ID, or None if it isn't cached."""
+
+        entry = self._entries.get(event_id)
+
+        if entry is None:
+            return None
+
+        (event, expires, _) = entry
+
+        if expires is not None and time.monotonic() >= expires:
+            del self._entries[event_id]
+            return None
+
+        self._entries.move_to_end(event_id)
+
+        return event
+
+    def put(self, event, update_seq=None):
+        """Cache an event, along with the update sequence it was fetched at."""
+
+        expires = None
+
+        if event.get("product") in MUTABLE_PRODUCTS:
+            expires = time.monotonic() + self._mutable_ttl
+
+        self._entries[event["_id"]] = (event, expires, update_seq)
+        self._entries.move_to_end(event["_id"])
+
+        # Evict the least recently used entries
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def get_update_seqs(self, event_ids):
+        """Get the update sequence each of the cached events that can be updated was fetched at, by ID."""
+
+        update_seqs = {}
+
+        for event_id in event_ids:
+            entry = self._entries.get(event_id)
+
+            if entry is not None and entry[1] is not None:
+                update_seqs[event_id] = entry[2]
+
+        return update_seqs
+
+    def invalidate(self, event_id):
+        """Remove an event from the cache, e.g. because it was replaced."""
+
+        self._entries.pop(event_id, None)
+
+    def clear(self):
+        """Remove every event from the cache."""
+
+        self._entries.clear()
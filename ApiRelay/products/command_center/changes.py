@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to find the Command Center events that changed since a client's last sync.
+
+The importers stamp every event they insert or replace with the next value of a shared update sequence (the
+'events' document in the 'counters' collection): 'insert_seq' when the event is first stored, and 'update_seq'
+every time it's written.  A sync token is an opaque encoding of the highest update sequence a client has seen.
+
+Sequence numbers are reserved before the write that uses them lands, so a write with a lower sequence can become
+visible after one with a higher sequence.  The token therefore only advances past changes that are older than a
+settle time; newer changes are returned, but will be returned again on the next sync, and clients apply changes
+by _id, so that's harmless.
+
+A filtered sync would otherwise only advance past the changes it matched, and rescan every other change since its
+last match on each sync.  Once it has every matching change, its token advances past the settled changes to any
+event instead.
+"""
+
+import base64
+import binascii
+import json
+
+from datetime import datetime, timedelta
+
+# The fields the importers maintain for syncing
+SYNC_FIELDS = ["insert_seq", "update_seq", "updated_at"]
+
+# Update sequences are stored as 64 bit integers
+MAX_SEQUENCE = 2 ** 63 - 1
+
+
+class InvalidSyncToken(ValueError):
+    """Raised when a client supplied sync token can't be decoded."""
+
+
+def encode_token(update_seq):
+    """Build an opaque sync token for an update sequence."""
+
+    token_json = json.dumps({"s": update_seq}, separators=(",", ":")).encode()
+
+    return base64.urlsafe_b64encode(token_json).decode().rstrip("=")
+
+
+def decode_token(token):
+    """Decode an opaque sync token into an update sequence."""
+
+    try:
+        # Restore the base64 padding that was stripped when encoding
+        token_json = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        update_seq = int(json.loads(token_json)["s"])
+
+    except (binascii.Error, KeyError, OverflowError, TypeError, ValueError):
+        raise InvalidSyncToken(f"Invalid sync token: {token}")
+
+    # An update sequence that can't be stored can't be queried either
+    if not 0 <= update_seq <= MAX_SEQUENCE:
+        raise InvalidSyncToken(f"Invalid sync token: {token}")
+
+    return update_seq
+
+
+async def get_current_sequence(command_center_db):
+    """Get the most recently reserved update sequence."""
+
+    counter = await command_center_db["counters"].find_one({"_id": "events"})
+
+    return counter["seq"] if counter else 0
+
+
+async def get_changes(command_center_events, since, query_filter=None, projection=None, limit=1000,
+                      settle_seconds=10, max_time_ms=None):
+    """Get up to 'limit' events written after the 'since' update sequence, and the update sequence to sync from next.
+
+    Returns a tuple of (inserted events, updated events, next update sequence, whether there are more changes).
+    There are never more changes when the update sequence didn't advance, since the client would only get the same
+    page again until the first change settles.  If there's a filter and every matching change has settled, the next
+    update sequence is the last settled change to any event.
+    """
+
+    # Include the sync fields in the projection, since they're needed to classify the changes
+    if projection:
+        projection = {**projection, **{field: 1 for field in SYNC_FIELDS}}
+
+    events = await (command_center_events.find({**(query_filter or {}), "update_seq": {"$gt": since}}, projection)
+                                         .sort("update_seq", 1)
+                                         .limit(limit + 1)
+                                         .max_time_ms(max_time_ms)
+                                         .to_list(length=None))
+
+    has_more = len(events) > limit
+    events = events[:limit]
+
+    inserted = []
+    updated = []
+    next_since = since
+
+    # Only advance the token past changes that have settled, so that late writes with lower sequences aren't skipped
+    settled_before = datetime.utcnow() - timedelta(seconds=settle_seconds)
+    settling = False
+
+    for event in events:
+
+        if event.get("insert_seq", 0) > since:
+            inserted.append(event)
+        else:
+            updated.append(event)
+
+        if not settling and event.get("updated_at") and event["updated_at"] < settled_before:
+            next_since = event["update_seq"]
+        else:
+            settling = True
+
+        # The sync fields are internal to the importers
+        for field in SYNC_FIELDS:
+            event.pop(field, None)
+
+    # Every matching change has been returned and has settled, so skip the settled changes the filter didn't match
+    if query_filter and not has_more and not settling:
+        next_since = max(next_since, await _get_settled_sequence(command_center_events, since, limit,
+                                                                 settled_before, max_time_ms))
+
+    # Syncing from the same update sequence straight away would only return the same, still settling, page
+    if next_since == since:
+        has_more = False
+
+    return (inserted, updated, next_since, has_more)
+
+
+async def _get_settled_sequence(command_center_events, since, limit, settled_before, max_time_ms=None):
+    """Get the update sequence of the last settled change to any event, among the latest 'limit' changes after the
+    'since' update sequence, or 'since' if none of them have settled.
+
+    The changes before the latest 'limit' are older than those, so they're taken to have settled too.
+    """
+
+    latest_changes = await (command_center_events.find({"update_seq": {"$gt": since}},
+                                                       {"update_seq": 1, "updated_at": 1})
+                                                 .sort("update_seq", -1)
+                                                 .limit(limit)
+                                                 .max_time_ms(max_time_ms)
+                                                 .to_list(length=None))
+
+    settled_seq = since
+
+    # Advance through the changes oldest first, stopping at the first one that's still settling
+    for change in reversed(latest_changes):
+
+        if not (change.get("updated_at") and change["updated_at"] < settled_before):
+            break
+
+        settled_seq = change["update_seq"]
+
+    return settled_seq
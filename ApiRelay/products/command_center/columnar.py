@@ -0,0 +1,44 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to encode Command Center event lists in a compact columnar format.
+
+Instead of an object per event, which repeats every key for every event, there's one array per field.  The
+fields whose values repeat heavily are dictionary encoded: each distinct value is listed once, and the events
+refer to it by its index.  Timestamps are epoch milliseconds, and IDs are hex strings.
+"""
+
+from products.command_center.pagination import to_epoch_millis
+
+# The fields that are dictionary encoded
+DICTIONARY_FIELDS = ["product", "event_name", "event_details"]
+
+
+def to_columns(events, fields):
+    """Convert a list of events into a dict of columns, one for the '_id' and each of the fields."""
+
+    columns = {"_id": [str(event["_id"]) for event in events]}
+
+    for field in fields:
+        values = [event.get(field) for event in events]
+
+        if field == "timestamp":
+            columns[field] = [value and to_epoch_millis(value) for value in values]
+
+        elif field in DICTIONARY_FIELDS:
+            columns[field] = dictionary_encode(values)
+
+        else:
+            columns[field] = values
+
+    return columns
+
+
+def dictionary_encode(values):
+    """Dictionary encode a list of values, returning the distinct values, and the index of each value in them."""
+
+    dictionary = {}
+
+    indexes = [dictionary.setdefault(value, len(dictionary)) for value in values]
+
+    return {"dictionary": list(dictionary), "indexes": indexes}
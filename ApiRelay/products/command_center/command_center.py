@@ -4,118 +4,280 @@
 This is a Python module to extend the API Relay for Command Center.
 """
 
-import json
-import os
-from bson.json_util import dumps
-from bson.objectid import ObjectId
-from datetime import datetime, timedelta
+import asyncio
 
-import pymongo
+from datetime import datetime, timedelta
+from typing import List
 
-from dotenv import load_dotenv
-from fastapi import APIRouter
+import config
 
-# Load the .env
-load_dotenv()
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from products.command_center import (addresses, cache, changes, columnar, conditional, encoder, guardrails,
+                                     index_manager, live, pagination, projections, rollups, storage)
+from products.command_center.repository import EventRepository, get_event_repository
+from pydantic import BaseModel
+from pymongo.errors import ExecutionTimeout
 
 router = APIRouter()
 
-# Events Functions
-@router.get('/events')
-def get_events(timeframe: int, event_name: str = None, product: str = None, src_ip: str = None):
-    """A function to retrieve events from the database and return them as JSON"""
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+SSE_MEDIA_TYPE = 'text/event-stream'
 
-    # Connect to the MongoDB instance
-    db_client = pymongo.MongoClient("mongodb://{}/".format(os.getenv("MONGO_INITDB_ADDRESS")),
-                                    username=os.getenv("MONGO_INITDB_ROOT_USERNAME"),
-                                    password=os.getenv("MONGO_INITDB_ROOT_PASSWORD"))
+# The fields returned for each event in event lists
+EVENT_LIST_PROJECTION = {
+    'event_name': 1,
+    'event_details': 1,
+    'product': 1,
+    'src_ip': 1,
+    'timestamp': 1
+}
 
-    # Use the 'commandcenter' database
-    command_center_db = db_client['commandcenter']
+# The fields the importers maintain for syncing, time series storage, CIDR queries and deduplication
+INTERNAL_FIELDS = [*changes.SYNC_FIELDS, 'meta', 'src_ip_num', 'event_key']
 
-    # Use the 'events' collection from the 'commandcenter' database
-    command_center_events = command_center_db['events']
+# The fields left out of full events
+EVENT_DETAIL_PROJECTION = {field: 0 for field in INTERNAL_FIELDS}
 
-    # Set up a basic query filter
-    query_filter = {}
+# The fields left out of full events when they're cached, which keeps the update sequence to check them against
+EVENT_CACHE_PROJECTION = {field: 0 for field in INTERNAL_FIELDS if field != 'update_seq'}
 
-    # If the source IP is specified, then only return those events.
-    if src_ip:
-        query_filter['src_ip'] = src_ip
+# A cache of recent responses, shared by every request in this process
+response_cache = cache.ResponseCache(max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+                                     ttl=config.RESPONSE_CACHE_TTL_SECONDS,
+                                     stale_ttl=config.RESPONSE_CACHE_STALE_SECONDS,
+                                     watermark_interval=config.RESPONSE_CACHE_WATERMARK_INTERVAL_SECONDS)
 
-    # If a timeframe is specified, then use it.
-    if timeframe:
-        query_date = datetime.utcnow().replace(microsecond=0) - timedelta(hours=timeframe)
-        query_filter['timestamp'] = {'$gte': query_date}
+# A single watcher for new events, shared by every live subscriber in this process
+event_broadcaster = live.EventBroadcaster(queue_size=config.LIVE_EVENTS_QUEUE_SIZE,
+                                          poll_interval=config.LIVE_EVENTS_POLL_INTERVAL_SECONDS)
 
-    # If a product is specified, then use it.
-    if product:
-        query_filter['product'] = {'$eq': product}
+# A cache of recently fetched events, checked against the database for updates and invalidated when the watcher
+# sees an event replaced
+event_cache = cache.EventCache(max_entries=config.EVENT_CACHE_MAX_ENTRIES,
+                               mutable_ttl=config.EVENT_CACHE_MUTABLE_TTL_SECONDS)
 
-    # If an event name is specified, then use it.
-    if event_name:
-        query_filter['event_name'] = {'$eq': event_name}
 
-    # Projection to return a subset of fields
-    projection = {
-        'event_name': 1,
-        'event_details': 1,
-        'product': 1,
-        'src_ip': 1,
-        'timestamp': 1
-    }
+class EventBatch(BaseModel):
+    """The body of a request for a batch of events by ID."""
+
+    ids: List[str]
 
-    # Get the events
-    latest_events = command_center_events.find(query_filter, projection).sort('timestamp', -1)
+
+def _invalidate_cached_event(operation, event):
+    """A function to drop an event from the event cache when the watcher sees it replaced"""
+
+    if operation == 'replace':
+        event_cache.invalidate(event['_id'])
+
+
+event_broadcaster.add_listener(_invalidate_cached_event)
+
+
+# Events Functions
+@router.get('/events')
+async def get_events(request: Request, timeframe: int, event_name: str = None, product: str = None,
+                     src_ip: str = None, src_cidr: str = None,
+                     limit: int = Query(config.EVENTS_DEFAULT_PAGE_SIZE, ge=1, le=config.EVENTS_MAX_PAGE_SIZE),
+                     cursor: str = None, stream: bool = False,
+                     format: str = Query('rows', regex='^(rows|columnar)$'), fields: str = None, q: str = None,
+                     sort: str = Query('time', regex='^(time|relevance)$'),
+                     repository: EventRepository = Depends(get_event_repository)):
+    """A function to retrieve a page of events from the database and return them as JSON
+
+    If 'stream' is set, or the client accepts 'application/x-ndjson', every event after the cursor is streamed back
+    as newline delimited JSON instead of being paged.  If the stream is cut short, its last line is a marker with
+    the reason, and where the newest first order allows it, a cursor to continue from.  If 'format' is 'columnar',
+    the page is returned as one array per field instead of one object per event.  If 'fields' is specified, only
+    those fields are returned.  If 'src_cidr' is specified, only events with a source IP in that CIDR block are
+    returned.
+
+    If 'q' is specified, only events whose names, details, destination or signature match the search terms are
+    returned, newest first, or if 'sort' is 'relevance', best match first.  Results by relevance aren't paged, so
+    only the first 'limit' events are returned.
+    """
+
+    # Build the query filter
+    query_filter = _build_query_filter(timeframe, event_name, product, src_ip, src_cidr)
+
+    # Newest events first, unless search results are ordered by relevance
+    sort_order = pagination.SORT_ORDER
+
+    # If search terms are specified, then only return the events matching them, using the text index
+    if q:
+        if config.EVENTS_STORAGE_MODE == storage.TIMESERIES:
+            raise HTTPException(status_code=501, detail="Text search isn't supported by time series storage")
+
+        query_filter['$text'] = {'$search': q}
+
+        if sort == 'relevance':
+            if cursor:
+                raise HTTPException(status_code=400, detail="Results by relevance can't be paged with a cursor")
+
+            sort_order = pagination.RELEVANCE_SORT_ORDER
+
+    # If a cursor is specified, then only return events older than it.
+    if cursor:
+        try:
+            query_filter = {'$and': [query_filter, pagination.keyset_filter(cursor)]}
+        except pagination.InvalidCursor as error:
+            raise HTTPException(status_code=400, detail=str(error))
+
+    # Projection to return a subset of fields, which always includes the timestamp, since the cursor is built on it
+    projection = EVENT_LIST_PROJECTION
+
+    if fields:
+        try:
+            projection = {**projections.parse_fields(fields), 'timestamp': 1}
+        except projections.InvalidProjection as error:
+            raise HTTPException(status_code=400, detail=str(error))
+
+    # Return the relevance score of results ordered by it
+    if sort_order == pagination.RELEVANCE_SORT_ORDER:
+        projection = {**projection, 'score': {'$meta': 'textScore'}}
+
+    # If streaming was requested, then stream the events instead of returning a page
+    if stream or NDJSON_MEDIA_TYPE in request.headers.get('accept', ''):
+        latest_events = repository.stream(query_filter, projection, batch_size=config.EVENTS_STREAM_BATCH_SIZE,
+                                          sort=sort_order)
+
+        return StreamingResponse(_stream_events(latest_events, pageable=sort_order == pagination.SORT_ORDER),
+                                 media_type=NDJSON_MEDIA_TYPE)
+
+    # Get the page of events, unless the client already has it.  Only the first page is validated, since the
+    # validator counts every event left in the filter, which would make walking through the pages quadratic.
+    return await _conditional_response(request, repository,
+                                       ('events', timeframe, event_name, product, src_ip, src_cidr, limit, cursor,
+                                        format, tuple(projection), q, sort),
+                                       None if cursor else query_filter,
+                                       lambda: _get_events_page(repository, query_filter, projection, limit,
+                                                                as_columns=format == 'columnar', sort=sort_order))
+
+
+@router.get('/events/stream')
+async def get_events_stream(request: Request, event_name: str = None, product: str = None, src_ip: str = None,
+                            repository: EventRepository = Depends(get_event_repository)):
+    """A function to push new and updated events to the client as Server-Sent Events
+
+    Each message's event type is the database operation ('insert' or 'replace'), and its data is the event as JSON.
+    If the client falls too far behind, the stream is closed and the client should reconnect.
+    """
+
+    # Build the query filter, without a timeframe, since only new events are sent
+    query_filter = {field: value for (field, value) in [('event_name', event_name), ('product', product),
+                                                       ('src_ip', src_ip)] if value}
+
+    # Subscribe to the shared watcher
+    subscription = event_broadcaster.subscribe(repository.events, query_filter)
+
+    return StreamingResponse(_sse_events(request, subscription), media_type=SSE_MEDIA_TYPE,
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@router.get('/events/changes')
+async def get_event_changes(since: str = None, event_name: str = None, product: str = None, src_ip: str = None,
+                            limit: int = Query(config.EVENTS_DEFAULT_PAGE_SIZE, ge=1, le=config.EVENTS_MAX_PAGE_SIZE),
+                            repository: EventRepository = Depends(get_event_repository)):
+    """A function to retrieve the events inserted or updated since a sync token and return them as JSON
+
+    Without a sync token, no changes are returned, only a token to sync from the current point onwards.  Events
+    expire from the database, so clients should drop any event older than 'tombstones.expired_before'.
+    """
+
+    # Build the query filter, without a timeframe, since changes are selected by their update sequence
+    query_filter = _build_query_filter(None, event_name, product, src_ip)
 
     # Set up a response object
     response_object = {
         'status': 'success',
-        'events': [],
+        'inserted': [],
+        'updated': [],
+        'tombstones': {
+            'expired_before': datetime.utcnow() - timedelta(seconds=index_manager.EVENT_RETENTION_SECONDS),
+        },
+        'next_since': None,
+        'has_more': False,
     }
 
-    # Iterate through all events
-    for event in latest_events:
+    # If there's no sync token, then start from the current update sequence
+    if since is None:
+        response_object['next_since'] = changes.encode_token(await repository.get_current_sequence())
 
-        # Make a human readable date if one doesn't exist - starting to do this on event import now
-        if 'formatted_timestamp' not in event.keys():
-            event['formatted_timestamp'] = event["timestamp"].strftime("%b %d, %Y %H:%M:%S UTC")
+        return encoder.MongoJSONResponse(response_object)
 
-        # Append the event to the response
-        response_object['events'].append(json.loads(dumps(event)))
+    try:
+        since = changes.decode_token(since)
+    except changes.InvalidSyncToken as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+    # Get the changed events
+    (inserted, updated, next_since, has_more) = await repository.get_changes(since, query_filter,
+                                                                             EVENT_LIST_PROJECTION, limit=limit,
+                                                                             settle_seconds=config.SYNC_SETTLE_SECONDS)
+
+    response_object['inserted'] = [_format_event(event) for event in inserted]
+    response_object['updated'] = [_format_event(event) for event in updated]
+    response_object['next_since'] = changes.encode_token(next_since)
+    response_object['has_more'] = has_more
+
+    return encoder.MongoJSONResponse(response_object)
+
+
+@router.get('/events/summary')
+async def get_events_summary(request: Request, timeframe: int = None, event_name: str = None, product: str = None,
+                             src_ip: str = None,
+                             top: int = Query(25, ge=1, le=100), fast_totals: bool = False,
+                             repository: EventRepository = Depends(get_event_repository)):
+    """A function to summarize the events in a timeframe for the dashboard widgets and return it as JSON
+
+    The summary has the total, the event counts per product, and the top event names and source IPs.  If
+    'fast_totals' is set and there are no filters, the total is an estimate from the collection metadata.
+    """
+
+    # Build the query filter
+    query_filter = _build_query_filter(timeframe, event_name, product, src_ip)
 
-    return response_object
+    # Get the summary, unless the client already has it
+    return await _conditional_response(request, repository,
+                                       ('events-summary', timeframe, event_name, product, src_ip, top, fast_totals),
+                                       query_filter,
+                                       lambda: _get_events_summary(repository, query_filter, top, fast_totals))
 
 
 @router.get('/event/{event_id}')
-def get_event(event_id: str):
-    """A function to retrieve an event from the database and return it as JSON"""
+async def get_event(event_id: str, fields: str = None,
+                    repository: EventRepository = Depends(get_event_repository)):
+    """A function to retrieve an event from the database and return it as JSON
 
-    # Connect to the MongoDB instance
-    db_client = pymongo.MongoClient("mongodb://{}/".format(os.getenv("MONGO_INITDB_ADDRESS")),
-                                    username=os.getenv("MONGO_INITDB_ROOT_USERNAME"),
-                                    password=os.getenv("MONGO_INITDB_ROOT_PASSWORD"))
+    If 'fields' is specified, only those fields are returned, or if they're prefixed with '-', they're left out.
+    """
 
-    # Use the 'commandcenter' database
-    command_center_db = db_client['commandcenter']
+    if fields:
+        try:
+            projection = projections.parse_fields(fields, allow_exclusion=True)
+        except projections.InvalidProjection as error:
+            raise HTTPException(status_code=400, detail=str(error))
 
-    # Use the 'events' collection from the 'commandcenter' database
-    command_center_events = command_center_db['events']
+        # An exclusion projection also has to leave out the fields the importers maintain
+        if 0 in projection.values():
+            projection.update(EVENT_DETAIL_PROJECTION)
 
-    # Set up a basic query filter
-    query_filter = {}
+        # Get the event
+        event = await repository.find_by_id(_parse_event_id(event_id), projection)
 
-    # Filter for the specified event ID
-    query_filter['_id'] = ObjectId(event_id)
+    else:
+        # Get the event, from the cache if it was fetched recently
+        object_id = _parse_event_id(event_id)
+        event = (await _get_events_by_id(repository, [object_id])).get(object_id)
 
-    # Get the event
-    event = command_center_events.find_one(query_filter)
+    if event is None:
+        raise HTTPException(status_code=404, detail=f"Event not found: {event_id}")
 
     # Make a human readable timestamp
-    event['formatted_timestamp'] = event["timestamp"].strftime("%b %d, %Y %H:%M:%S UTC")
-
-    # Parse the bson event into json
-    event = json.loads(dumps(event))
+    if 'timestamp' in event:
+        event['formatted_timestamp'] = event["timestamp"].strftime("%b %d, %Y %H:%M:%S UTC")
 
     # Set up a response object
     response_object = {
@@ -123,23 +285,129 @@ def get_event(event_id: str):
         'event': [event],
     }
 
-    return response_object
+    return encoder.MongoJSONResponse(response_object)
+
+
+@router.post('/events/batch')
+async def get_events_batch(batch: EventBatch, repository: EventRepository = Depends(get_event_repository)):
+    """A function to retrieve many events from the database by ID and return them as JSON
+
+    The events are returned in the order of the IDs, and any IDs that weren't found are returned in 'missing'.
+    """
+
+    if len(batch.ids) > config.EVENTS_BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {config.EVENTS_BATCH_MAX_IDS} events can be fetched")
+
+    event_ids = [_parse_event_id(event_id) for event_id in batch.ids]
+
+    # Get the events, from the cache if they were fetched recently
+    events = await _get_events_by_id(repository, event_ids)
+
+    # Set up a response object
+    response_object = {
+        'status': 'success',
+        'events': [_format_event(events[event_id]) for event_id in event_ids if event_id in events],
+        'missing': [str(event_id) for event_id in event_ids if event_id not in events],
+    }
+
+    return encoder.MongoJSONResponse(response_object)
 
 
 @router.get('/events-over-time')
-def get_events_over_time(timeframe: int, event_name: str = None, product: str = None, src_ip: str = None):
-    """A function to retrieve event counts from the database aggregated into intervals and return them as JSON"""
+async def get_events_over_time(request: Request, timeframe: int, event_name: str = None, product: str = None,
+                               src_ip: str = None, src_cidr: str = None,
+                               granularity: int = Query(None, ge=rollups.BUCKET_MINUTES, le=1440),
+                               group_by: str = Query(None, regex='^(product|event_name)$'),
+                               repository: EventRepository = Depends(get_event_repository)):
+    """A function to retrieve event counts from the database aggregated into intervals and return them as JSON
+
+    The interval is 'granularity' minutes, which is picked from the timeframe if it isn't specified.  If 'group_by'
+    is specified, a series of event counts is returned for each product or event name.
+    """
+
+    # If a granularity isn't specified, then pick one for the timeframe
+    if granularity is None:
+        granularity = rollups.get_granularity(timeframe)
+
+    # The intervals are built from rollup buckets, so they must be a multiple of them
+    if granularity % rollups.BUCKET_MINUTES:
+        raise HTTPException(status_code=400,
+                            detail=f"Granularity must be a multiple of {rollups.BUCKET_MINUTES} minutes")
+
+    # Build the query filter, without the timeframe, since the rollups are bucketed on a different field
+    query_filter = _build_query_filter(None, event_name, product, src_ip, src_cidr)
+
+    # Get the event counts, unless the client already has them.  The raw events aren't counted for the validator,
+    # since that would undo the rollups.
+    return await _conditional_response(request, repository,
+                                       ('events-over-time', timeframe, event_name, product, src_ip, src_cidr,
+                                        granularity, group_by),
+                                       _build_query_filter(timeframe, event_name, product, src_ip, src_cidr),
+                                       lambda: _get_event_counts(repository, timeframe, query_filter,
+                                                                 granularity, group_by),
+                                       count=False)
+
+
+# Diagnostics Functions
+@router.get('/diagnostics/indexes')
+async def get_index_report(repository: EventRepository = Depends(get_event_repository)):
+    """A function to report missing, unused and unexpected indexes on the events collection"""
+
+    # Set up a response object
+    response_object = {
+        'status': 'success',
+        'indexes': await repository.get_index_report(),
+    }
+
+    return encoder.MongoJSONResponse(response_object)
+
+
+@router.get('/diagnostics/explain')
+async def get_events_explain(timeframe: int, event_name: str = None, product: str = None, src_ip: str = None,
+                             src_cidr: str = None, repository: EventRepository = Depends(get_event_repository)):
+    """A function to explain how the database executes the events query for the specified filters"""
+
+    # Build the query filter
+    query_filter = _build_query_filter(timeframe, event_name, product, src_ip, src_cidr)
+
+    # Explain the same query that get_events runs for its first page
+    plan = await repository.explain(query_filter, limit=config.EVENTS_DEFAULT_PAGE_SIZE,
+                                    hint=guardrails.page_hint(query_filter), execute=True)
+
+    # Set up a response object
+    response_object = {
+        'status': 'success',
+        'filter': query_filter,
+        'plan': plan,
+    }
+
+    return encoder.MongoJSONResponse(response_object)
+
+
+@router.get('/diagnostics/queries')
+async def get_query_metrics(repository: EventRepository = Depends(get_event_repository)):
+    """A function to report the number of queries run, their slowest times, and the most recent slow queries"""
+
+    # Set up a response object
+    response_object = {
+        'status': 'success',
+        'queries': repository.get_query_metrics(),
+    }
+
+    return encoder.MongoJSONResponse(response_object)
+
 
-    # Connect to the MongoDB instance
-    db_client = pymongo.MongoClient("mongodb://{}/".format(os.getenv("MONGO_INITDB_ADDRESS")),
-                                    username=os.getenv("MONGO_INITDB_ROOT_USERNAME"),
-                                    password=os.getenv("MONGO_INITDB_ROOT_PASSWORD"))
+def _get_query_date(timeframe):
+    """A function to get the start of a timeframe, which is specified in hours"""
+
+    if timeframe:
+        return datetime.utcnow().replace(microsecond=0) - timedelta(hours=timeframe)
+
+    return None
 
-    # Use the 'commandcenter' database
-    command_center_db = db_client['commandcenter']
 
-    # Use the 'events' collection from the 'commandcenter' database
-    command_center_events = command_center_db['events']
+def _build_query_filter(timeframe, event_name=None, product=None, src_ip=None, src_cidr=None):
+    """A function to build an event query filter from the common request parameters"""
 
     # Set up a basic query filter
     query_filter = {}
@@ -148,10 +416,16 @@ def get_events_over_time(timeframe: int, event_name: str = None, product: str =
     if src_ip:
         query_filter['src_ip'] = src_ip
 
+    # If a source CIDR block is specified, then only return events from inside it.
+    if src_cidr:
+        try:
+            query_filter.update(addresses.cidr_filter(src_cidr))
+        except addresses.InvalidCidr as error:
+            raise HTTPException(status_code=400, detail=str(error))
+
     # If a timeframe is specified, then use it.
     if timeframe:
-        query_date = datetime.utcnow().replace(microsecond=0) - timedelta(hours=timeframe)
-        query_filter['timestamp'] = {'$gte': query_date}
+        query_filter['timestamp'] = {'$gte': _get_query_date(timeframe)}
 
     # If a product is specified, then use it.
     if product:
@@ -161,33 +435,236 @@ def get_events_over_time(timeframe: int, event_name: str = None, product: str =
     if event_name:
         query_filter['event_name'] = {'$eq': event_name}
 
-    # Get the aggregated events
-    aggregated_events = command_center_events.aggregate([
-        {"$match": query_filter},
-        {"$group":
-            {"_id":
-                {"$toDate":
-                    {"$subtract": [
-                        {"$toLong": "$timestamp"},
-                        {"$mod": [
-                            {"$toLong": "$timestamp"},
-                            1000 * 60 * 5
-                        ]}
-                    ]}},
-                "count": {"$sum": 1}}},
-        {"$sort": {"_id": 1}}
-    ])
+    return query_filter
+
+
+def _parse_event_id(event_id):
+    """A function to convert an event ID into an ObjectId"""
+
+    try:
+        return ObjectId(event_id)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail=f"Invalid event ID: {event_id}")
+
+
+async def _get_events_by_id(repository, event_ids):
+    """A function to get events by ID from the cache, fetching the rest from the database in a single query"""
+
+    events = {}
+    uncached_ids = []
+
+    # Look up each distinct ID in the cache
+    for event_id in dict.fromkeys(event_ids):
+        event = event_cache.get(event_id)
+
+        if event is None:
+            uncached_ids.append(event_id)
+        else:
+            events[event_id] = event
+
+    # Check the cached events that can be updated against their current update sequence, in a single query
+    cached_update_seqs = event_cache.get_update_seqs(events)
+
+    if cached_update_seqs:
+        update_seqs = await repository.get_update_seqs(cached_update_seqs)
+
+        for (event_id, update_seq) in cached_update_seqs.items():
+            if update_seqs.get(event_id) != update_seq:
+                event_cache.invalidate(event_id)
+                del events[event_id]
+                uncached_ids.append(event_id)
+
+    if uncached_ids:
+        for event in await repository.find_by_ids(uncached_ids, EVENT_CACHE_PROJECTION):
+            event_cache.put(event, event.pop('update_seq', None))
+            events[event['_id']] = event
+
+    return events
+
+
+def _format_event(event):
+    """A function to add the human readable fields to an event"""
+
+    # Make a human readable date if one doesn't exist - starting to do this on event import now
+    if 'formatted_timestamp' not in event.keys():
+        event['formatted_timestamp'] = event["timestamp"].strftime("%b %d, %Y %H:%M:%S UTC")
+
+    return event
+
+
+async def _conditional_response(request, repository, cache_key, query_filter, compute, count=True):
+    """A function to return a cached JSON response, or a 304 response if the client's copy is still current
+
+    The validator is checked first, since it's much cheaper than the response itself.  The response is cached
+    along with the validator it was checked against, so that a response is never served with a newer validator.
+    If there's no query filter, the response isn't validated.  If 'count' isn't set, the validator doesn't count
+    the events.
+    """
+
+    # Without a query filter, just get the response, from the cache if an identical request was made recently
+    if query_filter is None:
+        content = await response_cache.get(cache_key, compute, repository.get_watermark)
+
+        return Response(content, media_type='application/json', headers={'Cache-Control': 'no-cache'})
+
+    # Get the validator for the events the response is built from, from the cache if it was checked recently
+    validator = await response_cache.get(('validator', *cache_key),
+                                         lambda: repository.get_validator(query_filter, count),
+                                         repository.get_watermark)
+
+    headers = conditional.get_headers(validator)
+
+    # If the client already has the current response, then don't send it again.  A timeframe is a sliding window.
+    if conditional.is_not_modified(request.headers, validator, windowed='timestamp' in query_filter):
+        return Response(status_code=304, headers=headers)
+
+    # Get the response, from the cache if an identical request was made recently
+    content = await response_cache.get((*cache_key, validator), compute, repository.get_watermark)
+
+    return Response(content, media_type='application/json', headers=headers)
+
+
+async def _get_event_counts(repository, timeframe, query_filter, granularity, group_by):
+    """A function to get event counts from the database and encode them as JSON"""
+
+    # Get the aggregated events from the rollups, and the raw events for any partial buckets
+    aggregated_events = await repository.get_event_counts(_get_query_date(timeframe), query_filter,
+                                                          granularity=granularity, group_by=group_by)
 
     # Set up a response object
     response_object = {
         'status': 'success',
-        'event_counts': [],
+        'granularity': granularity,
     }
 
+    # If grouping was requested, then split the event counts into a series per group
+    if group_by:
+        series = {}
+
+        for event in aggregated_events:
+            series.setdefault(event.pop('series'), []).append(event)
+
+        response_object['series'] = [{'name': name, 'event_counts': event_counts}
+                                     for (name, event_counts) in series.items()]
+
+    else:
+        response_object['event_counts'] = aggregated_events
+
+    return encoder.encode(response_object)
+
+
+async def _get_events_summary(repository, query_filter, top, fast_totals):
+    """A function to get an events summary from the database and encode it as JSON"""
+
+    # Set up a response object
+    response_object = {
+        'status': 'success',
+        'summary': await repository.get_summary(query_filter, top=top, fast_totals=fast_totals),
+    }
+
+    return encoder.encode(response_object)
+
+
+async def _get_events_page(repository, query_filter, projection, limit, as_columns=False,
+                           sort=pagination.SORT_ORDER):
+    """A function to get a page of events from the database and encode it as JSON, optionally in columns"""
+
+    # Get one more event than the page size to find out if there's another page
+    latest_events = await repository.find_page(query_filter, projection, limit=limit + 1, sort=sort)
+
+    # Set up a response object
+    response_object = {
+        'status': 'success',
+        'events': [],
+        'next_cursor': None,
+    }
+
+    # If there's another page, trim the extra event and point the cursor at the last event of this page
+    if len(latest_events) > limit:
+        latest_events = latest_events[:limit]
+
+        # Only the newest first order can be paged with a cursor
+        if sort == pagination.SORT_ORDER:
+            response_object['next_cursor'] = pagination.encode_cursor(latest_events[-1])
+
+    # If the columnar format was requested, then return one array per field, leaving the formatting to the client
+    if as_columns:
+        del response_object['events']
+        response_object['format'] = 'columnar'
+        response_object['count'] = len(latest_events)
+        response_object['columns'] = columnar.to_columns(latest_events, list(projection))
+
+        return encoder.encode(response_object)
+
     # Iterate through all events
-    for event in aggregated_events:
+    for event in latest_events:
 
         # Append the event to the response
-        response_object['event_counts'].append(json.loads(dumps(event)))
+        response_object['events'].append(_format_event(event))
+
+    return encoder.encode(response_object)
+
+
+async def _stream_events(events, pageable=False):
+    """A generator to yield events from a database cursor as newline delimited JSON
+
+    If the events are cut short, because there are too many or the query runs out of time, a final line says so.
+    If the events are 'pageable', it also has a cursor pointing just past the last event streamed.
+    """
+
+    streamed = 0
+    last_event = None
+    truncated = None
+
+    # Iterate through the cursor, which fetches the events from the database a batch at a time
+    try:
+        async for event in events:
+            if streamed == config.EVENTS_STREAM_MAX_DOCUMENTS:
+                truncated = 'max_documents'
+                break
+
+            yield encoder.encode(_format_event(event)) + b'\n'
+
+            streamed += 1
+            last_event = event
+
+    except ExecutionTimeout:
+        truncated = 'timeout'
+
+    finally:
+        await events.aclose()
+
+    if truncated:
+        marker = {'status': 'truncated', 'reason': truncated, 'count': streamed, 'next_cursor': None}
+
+        if pageable and last_event:
+            marker['next_cursor'] = pagination.encode_cursor(last_event)
+
+        yield encoder.encode(marker) + b'\n'
+
+
+async def _sse_events(request, subscription):
+    """A generator to yield a subscription's events as Server-Sent Events until the client disconnects"""
+
+    try:
+        while not await request.is_disconnected():
+
+            # Wait for an event, sending a comment every so often to keep the connection open
+            try:
+                (operation, event) = await asyncio.wait_for(subscription.queue.get(),
+                                                            timeout=config.LIVE_EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield b': keep-alive\n\n'
+                continue
+
+            # The subscriber fell too far behind, so close the stream
+            if operation is None:
+                break
+
+            # Only send the fields that event lists use
+            event = {field: event[field] for field in ['_id', *EVENT_LIST_PROJECTION] if field in event}
+
+            yield b'event: ' + operation.encode() + b'\ndata: ' + encoder.encode(_format_event(event)) + b'\n\n'
 
-    return response_object
+    finally:
+        event_broadcaster.unsubscribe(subscription)
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to answer conditional GET requests for Command Center events.
+
+A response's validator is the newest event timestamp and the event count for its filter, along with the current
+update sequence, which changes whenever an importer inserts or replaces an event.  These are cheap, indexed
+lookups, so a client polling with 'If-None-Match' or 'If-Modified-Since' gets a 304 response, without the events
+query being run, whenever nothing has changed.
+
+Responses built from the rollups aren't validated with a count, since counting the raw events would undo the
+rollups.  Their validator has the oldest event timestamp instead, which changes as events age out of a timeframe.
+"""
+
+import hashlib
+
+from collections import namedtuple
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+Validator = namedtuple("Validator", ["last_modified", "count", "update_seq", "oldest"], defaults=[None])
+
+
+def make_etag(validator):
+    """Build a weak entity tag from a validator."""
+
+    digest = hashlib.sha1(repr(tuple(validator)).encode()).hexdigest()[:20]
+
+    return f'W/"{digest}"'
+
+
+def get_headers(validator):
+    """Build the validator headers for a response.  Clients must revalidate, since events can be imported anytime."""
+
+    headers = {
+        "ETag": make_etag(validator),
+        "Cache-Control": "no-cache",
+    }
+
+    if validator.last_modified:
+        headers["Last-Modified"] = format_datetime(validator.last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+
+    return headers
+
+
+def is_not_modified(request_headers, validator, windowed=False):
+    """Check whether a request's conditional headers show that the client already has the current response.
+
+    If the response covers a 'windowed' timeframe, 'If-Modified-Since' is ignored, since events aging out of the
+    timeframe change the response without changing its last modified time.
+    """
+
+    if_none_match = request_headers.get("if-none-match")
+
+    # 'If-None-Match' takes precedence over 'If-Modified-Since', and is compared weakly
+    if if_none_match is not None:
+        etag = make_etag(validator)
+        client_etags = [client_etag.strip() for client_etag in if_none_match.split(",")]
+
+        return "*" in client_etags or any(_strip_weak(client_etag) == _strip_weak(etag)
+                                          for client_etag in client_etags)
+
+    if_modified_since = request_headers.get("if-modified-since")
+
+    if if_modified_since is not None and validator.last_modified and not windowed:
+        try:
+            if_modified_since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+        # HTTP dates only have a resolution of seconds
+        last_modified = validator.last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+
+        return if_modified_since.tzinfo is not None and last_modified <= if_modified_since
+
+    return False
+
+
+def _strip_weak(etag):
+    """Remove the weak indicator from an entity tag."""
+
+    return etag[2:] if etag.startswith("W/") else etag
@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to encode MongoDB documents directly into JSON bytes.
+
+Documents are encoded in a single pass into the same shape that bson.json_util produces (ObjectIds as
+{"$oid": ...} and datetimes as {"$date": <epoch millis>}), so responses don't need to be dumped to a string,
+parsed back into a dict, and re-encoded by FastAPI.  orjson is used when it's installed, otherwise the
+standard library's json module is used.
+"""
+
+import json
+
+from bson import json_util
+from bson.objectid import ObjectId
+from datetime import datetime, timezone
+from starlette.responses import Response
+
+from products.command_center.pagination import to_epoch_millis
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    """Convert the BSON types that JSON can't represent natively."""
+
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+
+    if isinstance(value, datetime):
+
+        # Timezone aware datetimes are converted to naive UTC, which is how MongoDB stores them
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+
+        return {"$date": to_epoch_millis(value)}
+
+    # Fall back to bson.json_util for any other BSON types
+    return json_util.default(value, json_options=json_util.LEGACY_JSON_OPTIONS)
+
+
+def encode(document):
+    """Encode a document, or any structure containing documents, into JSON bytes."""
+
+    if orjson:
+        return orjson.dumps(document, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+    return json.dumps(document, default=_default, separators=(",", ":")).encode()
+
+
+class MongoJSONResponse(Response):
+    """A response that encodes its MongoDB content directly into JSON bytes."""
+
+    media_type = "application/json"
+
+    def render(self, content):
+        return encode(content)
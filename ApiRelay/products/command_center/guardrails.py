@@ -0,0 +1,192 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to keep Command Center queries from monopolizing the database.
+
+Every query the API Relay runs has a time budget (maxTimeMS), after which MongoDB aborts it, so that one huge
+query can't stall every other dashboard.  Queries with a known shape are given an index hint, and the number of
+events streamed is capped.  Queries that take longer than the slow query threshold are logged, along with their
+filter, duration and plan, and counted per query.
+"""
+
+import asyncio
+import time
+
+import config
+
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from pymongo.errors import ExecutionTimeout, PyMongoError
+
+# The indexes for equality filters on a field, most selective first
+FIELD_HINTS = [
+    ("src_ip_num", "src_ip_num_1_timestamp_-1"),
+    ("src_ip", "src_ip_1_timestamp_-1"),
+    ("meta.src_ip", "meta.src_ip_1_timestamp_-1"),
+    ("event_name", "event_name_1_timestamp_-1"),
+    ("product", "product_1_timestamp_-1"),
+    ("meta.product", "meta.product_1_timestamp_-1"),
+]
+
+# The index that serves the newest first sort order on its own
+SORT_HINT = "timestamp_-1__id_-1"
+
+# The indexes confirmed to exist on the events collection.  Hinting a missing index fails the query, so only these
+# are hinted.
+available_indexes = set()
+
+
+async def refresh_available_indexes(command_center_events):
+    """Record which indexes exist on the events collection, once their builds have finished."""
+
+    index_information = await command_center_events.index_information()
+
+    available_indexes.clear()
+    available_indexes.update(index_information)
+
+    return available_indexes
+
+
+def page_hint(query_filter):
+    """Pick the index for a page of events in the newest first order, if the filter only limits the time range.
+
+    Filtered pages are left to the query planner, since forcing a filter index would mean sorting in memory.
+    """
+
+    fields = _filter_fields(query_filter)
+
+    if not config.QUERY_HINTS_ENABLED or fields is None:
+        return None
+
+    return SORT_HINT if fields <= {"timestamp", "_id"} and SORT_HINT in available_indexes else None
+
+
+def count_hint(query_filter):
+    """Pick the index for counting or aggregating the events matching a filter, which don't need sorting."""
+
+    fields = _filter_fields(query_filter)
+
+    if not config.QUERY_HINTS_ENABLED or fields is None:
+        return None
+
+    for (field, index_name) in FIELD_HINTS:
+        if field in fields and index_name in available_indexes:
+            return index_name
+
+    return SORT_HINT if "timestamp" in fields and SORT_HINT in available_indexes else None
+
+
+def query_options(max_time_ms=None, hint=None):
+    """Build the keyword arguments that apply a time budget and hint to a query."""
+
+    options = {}
+
+    if max_time_ms:
+        options["maxTimeMS"] = max_time_ms
+
+    if hint:
+        options["hint"] = hint
+
+    return options
+
+
+def _filter_fields(query_filter):
+    """Get the top level fields a filter matches on, including inside '$and', or None if it can't be hinted."""
+
+    fields = set()
+
+    for (field, value) in query_filter.items():
+
+        # Text searches always use the text index, and can't be hinted
+        if field == "$text":
+            return None
+
+        if field == "$and":
+            for clause in value:
+                clause_fields = _filter_fields(clause)
+
+                if clause_fields is None:
+                    return None
+
+                fields |= clause_fields
+
+        # The keyset cursor filter is a range on (timestamp, _id)
+        elif field == "$or":
+            fields |= {clause_field for clause in value for clause_field in clause}
+
+        else:
+            fields.add(field)
+
+    return fields
+
+
+class QueryMonitor(object):
+    """Counts queries per name, and logs the slow ones."""
+
+    def __init__(self, slow_ms=500, max_entries=100):
+        """Initializes the QueryMonitor object."""
+
+        self._slow_ms = slow_ms
+
+        self.metrics = {}
+        self.slow_queries = deque(maxlen=max_entries)
+
+    @asynccontextmanager
+    async def track(self, name, query_filter=None, hint=None, explain=None):
+        """Time the query run inside the block, and log it if it's slow or runs out of time.
+
+        If the query is slow and an 'explain' coroutine function is provided, its plan is added to the log entry
+        in the background.
+        """
+
+        metric = self.metrics.setdefault(name, {"count": 0, "slow": 0, "timeouts": 0, "max_ms": 0})
+        started = time.perf_counter()
+        timed_out = False
+
+        try:
+            yield
+
+        except ExecutionTimeout:
+            timed_out = True
+            metric["timeouts"] += 1
+            raise
+
+        finally:
+            duration_ms = round((time.perf_counter() - started) * 1000, 1)
+
+            metric["count"] += 1
+            metric["max_ms"] = max(metric["max_ms"], duration_ms)
+
+            if timed_out or duration_ms >= self._slow_ms:
+                metric["slow"] += 1
+                self._log(name, query_filter, hint, duration_ms, timed_out, explain)
+
+    def _log(self, name, query_filter, hint, duration_ms, timed_out, explain):
+        """Log a slow query."""
+
+        entry = {
+            "query": name,
+            "filter": query_filter,
+            "hint": hint,
+            "duration_ms": duration_ms,
+            "timed_out": timed_out,
+            "logged_at": datetime.utcnow(),
+            "plan": None,
+        }
+
+        self.slow_queries.append(entry)
+
+        print(f"Slow query '{name}' took {duration_ms} ms{' and timed out' if timed_out else ''}: {query_filter}")
+
+        if explain:
+            asyncio.ensure_future(self._add_plan(entry, explain))
+
+    async def _add_plan(self, entry, explain):
+        """Add the plan of a slow query to its log entry."""
+
+        try:
+            entry["plan"] = await explain()
+        except PyMongoError as error:
+            print(f"Unable to explain slow query '{entry['query']}': {error}")
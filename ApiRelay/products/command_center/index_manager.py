@@ -0,0 +1,136 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to manage the indexes on the Command Center 'events' collection.
+
+The indexes below match the shapes of the queries issued by the API Relay and the event importers, so that
+event lookups are index scans rather than collection scans as the collection grows.
+"""
+
+import pymongo
+
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+# How long events are kept before MongoDB expires them (31 days), matching mongo-init.js
+EVENT_RETENTION_SECONDS = 2678400
+
+# The indexes the 'events' collection should have, and the query shapes they support
+EVENT_INDEXES = [
+    # Expire old events, and range scans on timestamp alone
+    IndexModel([("timestamp", pymongo.ASCENDING)],
+               name="timestamp_1", expireAfterSeconds=EVENT_RETENTION_SECONDS),
+
+    # Unfiltered event pages, sorted by (timestamp, _id)
+    IndexModel([("timestamp", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)],
+               name="timestamp_-1__id_-1"),
+
+    # Product filters, and the importers' search for their latest event
+    IndexModel([("product", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)],
+               name="product_1_timestamp_-1"),
+
+    # Event name filters
+    IndexModel([("event_name", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)],
+               name="event_name_1_timestamp_-1"),
+
+    # Source IP filters, used by the host views
+    IndexModel([("src_ip", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)],
+               name="src_ip_1_timestamp_-1"),
+
+    # Source IP range (CIDR) filters
+    IndexModel([("src_ip_num", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)],
+               name="src_ip_num_1_timestamp_-1"),
+
+    # Text search over the event names and details, and the vendor fields analysts search for
+    IndexModel([("event_name", pymongo.TEXT), ("event_details", pymongo.TEXT), ("destination", pymongo.TEXT),
+                ("snort_name", pymongo.TEXT)],
+               name="event_text", default_language="none",
+               weights={"event_name": 10, "snort_name": 5, "destination": 5, "event_details": 1}),
+
+    # Changes since a sync token
+    IndexModel([("update_seq", pymongo.ASCENDING)],
+               name="update_seq_1"),
+
+    # The importers' idempotency keys, which keep an event from being stored twice, and key Stealthwatch upserts
+    IndexModel([("event_key", pymongo.ASCENDING)],
+               name="event_key_1", unique=True, partialFilterExpression={"event_key": {"$exists": True}}),
+]
+
+
+async def ensure_indexes(collection, indexes=EVENT_INDEXES):
+    """Create any of the expected indexes that don't exist yet, and return the names of the ensured indexes."""
+
+    ensured = []
+
+    for index in indexes:
+
+        # Create the indexes one at a time so that a conflicting index doesn't stop the others from being created
+        try:
+            ensured += await collection.create_indexes([index])
+        except OperationFailure as error:
+            print(f"Unable to create index {index.document['name']} on '{collection.name}': {error}")
+
+    return ensured
+
+
+async def get_index_report(collection, indexes=EVENT_INDEXES):
+    """Report which expected indexes are missing, and which existing indexes are unused or unexpected."""
+
+    expected = [index.document["name"] for index in indexes]
+
+    # Get the usage statistics for the existing indexes
+    index_stats = {stat["name"]: stat async for stat in collection.aggregate([{"$indexStats": {}}])}
+
+    report = {
+        "expected": expected,
+        "missing": [name for name in expected if name not in index_stats],
+        "unexpected": [name for name in index_stats if name not in expected and name != "_id_"],
+        "unused": [],
+        "usage": {},
+    }
+
+    for name, stat in index_stats.items():
+
+        # Record how often each index has been used since the statistics were reset (usually a server restart)
+        report["usage"][name] = {
+            "ops": stat["accesses"]["ops"],
+            "since": stat["accesses"]["since"],
+        }
+
+        if not stat["accesses"]["ops"] and name != "_id_":
+            report["unused"].append(name)
+
+    return report
+
+
+def summarize_explain(explain_output):
+    """Summarize the output of an explain into the winning plan's stages, indexes and execution statistics."""
+
+    query_planner = explain_output.get("queryPlanner", {})
+    execution_stats = explain_output.get("executionStats", {})
+
+    # Newer MongoDB versions nest the plan under 'queryPlan'
+    plan = query_planner.get("winningPlan", {})
+    plan = plan.get("queryPlan", plan)
+
+    stages = []
+    index_names = []
+
+    # Walk down the plan from the root stage to the leaf stages
+    while plan:
+        stages.append(plan.get("stage"))
+
+        if plan.get("indexName"):
+            index_names.append(plan["indexName"])
+
+        plan = plan.get("inputStage") or next(iter(plan.get("inputStages", [])), None)
+
+    return {
+        "stages": stages,
+        "indexes": index_names,
+        "collection_scan": "COLLSCAN" in stages,
+        "returned": execution_stats.get("nReturned"),
+        "keys_examined": execution_stats.get("totalKeysExamined"),
+        "documents_examined": execution_stats.get("totalDocsExamined"),
+        "execution_time_ms": execution_stats.get("executionTimeMillis"),
+    }
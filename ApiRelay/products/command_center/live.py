@@ -0,0 +1,153 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to push new Command Center events to live subscribers.
+
+A single EventBroadcaster per process watches the 'events' collection and fans every new or updated event out to
+the subscribers whose filters it matches, so the database sees one watcher no matter how many dashboards are
+tailing events.  The watcher uses a MongoDB change stream, and falls back to polling for newly inserted events
+when change streams aren't available (they require a replica set).
+"""
+
+import asyncio
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+# The errors MongoDB returns when change streams aren't supported by the deployment, or by time series collections
+CHANGE_STREAM_NOT_SUPPORTED = [40573, 166]
+
+# The operations the change stream watches for
+WATCHED_OPERATIONS = ["insert", "replace"]
+
+
+class Subscription(object):
+    """A subscriber's filters, and the queue of (operation, event) tuples waiting to be sent to it."""
+
+    def __init__(self, filters, queue_size):
+        """Initializes the Subscription object."""
+
+        self.filters = filters
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def matches(self, event):
+        """Check whether an event matches the subscriber's equality filters."""
+
+        return all(event.get(field) == value for (field, value) in self.filters.items())
+
+
+class EventBroadcaster(object):
+    """A single shared watcher for new events, fanned out to every subscriber."""
+
+    def __init__(self, queue_size=1000, poll_interval=2, retry_interval=5):
+        """Initializes the EventBroadcaster object.  Intervals are in seconds."""
+
+        self._queue_size = queue_size
+        self._poll_interval = poll_interval
+        self._retry_interval = retry_interval
+
+        self._subscriptions = set()
+        self._listeners = []
+        self._task = None
+
+    def subscribe(self, command_center_events, filters):
+        """Subscribe to new events matching the equality filters, starting the watcher if needed."""
+
+        subscription = Subscription(filters, self._queue_size)
+        self._subscriptions.add(subscription)
+
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._watch(command_center_events))
+
+        return subscription
+
+    def add_listener(self, listener):
+        """Call a function with the operation and event for everything the watcher sees, while it's running."""
+
+        self._listeners.append(listener)
+
+    def unsubscribe(self, subscription):
+        """Remove a subscription, stopping the watcher once nobody is subscribed."""
+
+        self._subscriptions.discard(subscription)
+
+        if not self._subscriptions:
+            self.stop()
+
+    def stop(self):
+        """Stop the watcher."""
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def publish(self, operation, event):
+        """Send an event to every listener, and every subscriber whose filters it matches."""
+
+        for listener in self._listeners:
+            listener(operation, event)
+
+        for subscription in list(self._subscriptions):
+
+            if subscription.overflowed or not subscription.matches(event):
+                continue
+
+            try:
+                subscription.queue.put_nowait((operation, event))
+
+            # If a subscriber can't keep up, drop it rather than buffering without bound.  It will reconnect.
+            except asyncio.QueueFull:
+                subscription.overflowed = True
+                subscription.queue.get_nowait()
+                subscription.queue.put_nowait((None, None))
+
+    async def _watch(self, command_center_events):
+        """Watch for new events until cancelled, using a change stream if possible, or polling otherwise."""
+
+        resume_token = None
+
+        while True:
+            try:
+                pipeline = [{"$match": {"operationType": {"$in": WATCHED_OPERATIONS}}}]
+
+                async with command_center_events.watch(pipeline, full_document="updateLookup",
+                                                       resume_after=resume_token) as change_stream:
+                    async for change in change_stream:
+                        resume_token = change_stream.resume_token
+
+                        if change.get("fullDocument"):
+                            self.publish(change["operationType"], change["fullDocument"])
+
+            except PyMongoError as error:
+                if isinstance(error, OperationFailure):
+
+                    # Fall back to polling if change streams aren't supported at all
+                    if error.code in CHANGE_STREAM_NOT_SUPPORTED:
+                        print("Change streams aren't supported for the events.  Polling for new events instead.")
+                        await self._poll(command_center_events)
+
+                    # The server rejected the change stream, which may be because it can't resume, so start afresh
+                    resume_token = None
+
+                print(f"Event watcher failed, retrying in {self._retry_interval} seconds: {error}")
+                await asyncio.sleep(self._retry_interval)
+
+    async def _poll(self, command_center_events):
+        """Poll for newly inserted events until cancelled."""
+
+        # Start from the most recently inserted event
+        latest_insert = await command_center_events.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        latest_id = latest_insert and latest_insert["_id"]
+
+        while True:
+            await asyncio.sleep(self._poll_interval)
+
+            query_filter = {"_id": {"$gt": latest_id}} if latest_id else {}
+
+            try:
+                async for event in command_center_events.find(query_filter).sort("_id", 1):
+                    latest_id = event["_id"]
+                    self.publish("insert", event)
+
+            except PyMongoError as error:
+                print(f"Event poll failed, retrying in {self._poll_interval} seconds: {error}")
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to handle keyset (cursor) pagination of Command Center events.
+
+Events are returned newest first, ordered by (timestamp, _id).  A cursor is an opaque token that encodes the
+(timestamp, _id) of the last event on a page, and the next page is every event strictly "older" than that key.
+This keeps each page an index range scan, regardless of how deep into the history the client has paged.
+"""
+
+import base64
+import binascii
+import json
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from datetime import datetime, timedelta
+
+# The sort order used for all paginated event queries
+SORT_ORDER = [("timestamp", -1), ("_id", -1)]
+
+# The order of text search results by relevance, which can't be paged with a cursor
+RELEVANCE_SORT_ORDER = [("score", {"$meta": "textScore"}), *SORT_ORDER]
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client supplied cursor can't be decoded."""
+
+
+def to_epoch_millis(timestamp):
+    """Convert a naive UTC datetime into milliseconds since the epoch."""
+
+    return (timestamp - EPOCH) // timedelta(milliseconds=1)
+
+
+def from_epoch_millis(millis):
+    """Convert milliseconds since the epoch into a naive UTC datetime."""
+
+    return EPOCH + timedelta(milliseconds=millis)
+
+
+def encode_cursor(event):
+    """Build an opaque cursor pointing just past the provided event."""
+
+    cursor_data = {
+        "t": to_epoch_millis(event["timestamp"]),
+        "id": str(event["_id"]),
+    }
+
+    cursor_json = json.dumps(cursor_data, separators=(",", ":")).encode()
+
+    return base64.urlsafe_b64encode(cursor_json).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decode an opaque cursor into a (timestamp, ObjectId) tuple."""
+
+    try:
+        # Restore the base64 padding that was stripped when encoding
+        cursor_json = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_data = json.loads(cursor_json)
+
+        # A timestamp outside of the range of datetimes raises an OverflowError
+        return (from_epoch_millis(int(cursor_data["t"])), ObjectId(cursor_data["id"]))
+
+    except (binascii.Error, InvalidId, KeyError, OverflowError, TypeError, ValueError):
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
+
+
+def keyset_filter(cursor):
+    """Build a query filter matching every event that sorts after the provided cursor."""
+
+    (timestamp, object_id) = decode_cursor(cursor)
+
+    return {
+        "$or": [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": object_id}},
+        ]
+    }
@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to build event projections from the fields a client asks for.
+
+Clients pass a comma separated list of fields, e.g. 'fields=event_name,src_ip,timestamp' to only include those
+fields, or, where excluding is allowed, 'fields=-computer,-file' to leave out bulky vendor sub-documents.  Only
+the fields in the allow-list (and their sub-fields, e.g. 'file.file_name') can be selected, so the internal
+fields the importers maintain are never exposed.
+"""
+
+import re
+
+# The fields that clients can select
+EVENT_FIELDS = {
+    # The common fields every importer sets
+    "event_name", "event_details", "product", "src_ip", "timestamp", "formatted_timestamp",
+
+    # AMP for Endpoints
+    "id", "computer", "connector_guid", "date", "detection", "event_type", "file", "severity",
+
+    # Firepower
+    "classification", "dst_geo", "dst_ip", "dst_port", "fmc_hostname", "impact_level", "priority", "protocol",
+    "sensor_name", "snort_id", "snort_name", "src_geo", "src_port",
+
+    # Stealthwatch
+    "firstActiveTime", "hitCount", "lastActiveTime", "securityEventType", "source", "target",
+
+    # Umbrella
+    "actionTaken", "categories", "destination", "externalIp", "internalIp", "originLabel", "originType",
+}
+
+# A field name, which can't be an operator or contain anything but a plain name
+FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class InvalidProjection(ValueError):
+    """Raised when the client supplied fields can't be used to build a projection."""
+
+
+def parse_fields(fields, allow_exclusion=False):
+    """Build a projection from a comma separated list of fields, prefixed with '-' to exclude them."""
+
+    included = set()
+    excluded = set()
+
+    for field in filter(None, (field.strip() for field in fields.split(","))):
+
+        if field.startswith("-") and allow_exclusion:
+            field = field[1:]
+            selected = excluded
+        else:
+            selected = included
+
+        path = field.split(".")
+
+        if path[0] not in EVENT_FIELDS or not all(FIELD_PATTERN.match(name) for name in path):
+            raise InvalidProjection(f"Unknown field: {field}")
+
+        selected.add(field)
+
+    # MongoDB can't both include and exclude fields in one projection
+    if included and excluded:
+        raise InvalidProjection("Fields can't be both included and excluded")
+
+    if not (included or excluded):
+        raise InvalidProjection("No fields were specified")
+
+    # The formatted timestamp is made from the timestamp if it isn't stored
+    if "formatted_timestamp" in included:
+        included.add("timestamp")
+
+    return {field: 1 for field in sorted(included)} or {field: 0 for field in sorted(excluded)}
@@ -0,0 +1,214 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to provide asynchronous access to the Command Center events.
+
+The EventRepository wraps the shared Motor client, so that the Command Center endpoints can be 'async def' and
+multiplex their database queries on the event loop, rather than each holding a threadpool thread while MongoDB
+works.  Every query is given a time budget and, where its shape is known, an index hint, and is timed by the
+shared QueryMonitor.
+"""
+
+import config
+import database
+
+from bson.objectid import ObjectId
+from fastapi import Depends
+
+from products.command_center import (changes, conditional, guardrails, index_manager, pagination, rollups, storage,
+                                     summary)
+
+# Counts the queries run by every repository in this process, and logs the slow ones
+query_monitor = guardrails.QueryMonitor(slow_ms=config.SLOW_QUERY_MS, max_entries=config.SLOW_QUERY_LOG_SIZE)
+
+
+class EventRepository(object):
+    """Asynchronous access to the Command Center events and their rollups."""
+
+    def __init__(self, command_center_db, monitor=query_monitor):
+        """Initializes the EventRepository object."""
+
+        self.db = command_center_db
+        self.events = command_center_db["events"]
+        self.rollups = command_center_db["event_rollups"]
+        self.monitor = monitor
+
+    async def find_page(self, query_filter, projection=None, limit=None, sort=pagination.SORT_ORDER):
+        """Get up to 'limit' events matching the filter, newest first unless another sort order is specified."""
+
+        query_filter = self._storage_filter(query_filter)
+        hint = guardrails.page_hint(query_filter) if sort == pagination.SORT_ORDER else None
+
+        cursor = self.events.find(query_filter, projection).sort(sort).max_time_ms(config.QUERY_MAX_TIME_MS)
+
+        if limit:
+            cursor = cursor.limit(limit)
+
+        if hint:
+            cursor = cursor.hint(hint)
+
+        async with self.monitor.track("find_page", query_filter, hint,
+                                      lambda: self.explain(query_filter, limit=limit, sort=sort, hint=hint)):
+            return await cursor.to_list(length=None)
+
+    async def stream(self, query_filter, projection=None, batch_size=None, sort=pagination.SORT_ORDER):
+        """Yield every event matching the filter, newest first unless another sort order is specified, fetching
+        them from the database in batches.  At most EVENTS_STREAM_MAX_DOCUMENTS events are streamed, followed by
+        one more if there are more, so that the caller can tell the stream was truncated."""
+
+        query_filter = self._storage_filter(query_filter)
+        hint = guardrails.page_hint(query_filter) if sort == pagination.SORT_ORDER else None
+
+        cursor = (self.events.find(query_filter, projection)
+                             .sort(sort)
+                             .limit(config.EVENTS_STREAM_MAX_DOCUMENTS + 1)
+                             .max_time_ms(config.QUERY_STREAM_MAX_TIME_MS))
+
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+
+        if hint:
+            cursor = cursor.hint(hint)
+
+        async with self.monitor.track("stream", query_filter, hint,
+                                      lambda: self.explain(query_filter, sort=sort, hint=hint)):
+            async for event in cursor:
+                yield event
+
+    async def find_by_id(self, event_id, projection=None):
+        """Get a single event by its ID."""
+
+        return await self.events.find_one({"_id": ObjectId(event_id)}, projection,
+                                          max_time_ms=config.QUERY_MAX_TIME_MS)
+
+    async def find_by_ids(self, event_ids, projection=None):
+        """Get the events with any of the IDs, in a single query."""
+
+        cursor = self.events.find({"_id": {"$in": list(event_ids)}}, projection).max_time_ms(config.QUERY_MAX_TIME_MS)
+
+        async with self.monitor.track("find_by_ids"):
+            return await cursor.to_list(length=None)
+
+    async def get_update_seqs(self, event_ids):
+        """Get the current update sequence of the events with any of the IDs, by ID, in a single query."""
+
+        cursor = (self.events.find({"_id": {"$in": list(event_ids)}}, {"update_seq": 1})
+                             .max_time_ms(config.QUERY_MAX_TIME_MS))
+
+        async with self.monitor.track("get_update_seqs"):
+            return {event["_id"]: event.get("update_seq") for event in await cursor.to_list(length=None)}
+
+    async def get_event_counts(self, start=None, filters=None, granularity=rollups.BUCKET_MINUTES, group_by=None):
+        """Get event counts per interval from the rollups and raw events."""
+
+        async with self.monitor.track("get_event_counts", filters):
+            return await rollups.get_event_counts(self.db, start, filters, granularity=granularity, group_by=group_by,
+                                                  max_time_ms=config.QUERY_AGGREGATE_MAX_TIME_MS,
+                                                  storage_mode=config.EVENTS_STORAGE_MODE)
+
+    async def get_summary(self, query_filter, top=25, fast_totals=False):
+        """Get the event counts per product, top event names and top source IPs in a single aggregation."""
+
+        query_filter = self._storage_filter(query_filter)
+        hint = guardrails.count_hint(query_filter)
+
+        async with self.monitor.track("get_summary", query_filter, hint):
+            return await summary.get_summary(self.events, query_filter, top=top, fast_totals=fast_totals,
+                                             max_time_ms=config.QUERY_AGGREGATE_MAX_TIME_MS, hint=hint)
+
+    async def get_changes(self, since, query_filter=None, projection=None, limit=1000, settle_seconds=10):
+        """Get the events written after an update sequence, split into inserts and updates."""
+
+        query_filter = self._storage_filter(query_filter)
+
+        async with self.monitor.track("get_changes", query_filter):
+            return await changes.get_changes(self.events, since, query_filter, projection, limit=limit,
+                                             settle_seconds=settle_seconds, max_time_ms=config.QUERY_MAX_TIME_MS)
+
+    async def get_current_sequence(self):
+        """Get the most recently reserved update sequence."""
+
+        return await changes.get_current_sequence(self.db)
+
+    async def get_watermark(self):
+        """Get the newest event timestamp and the newest inserted event ID, to detect new events."""
+
+        latest_event = await self.events.find_one({}, {"timestamp": 1}, sort=[("timestamp", -1)])
+        latest_insert = await self.events.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+
+        return (latest_event and latest_event["timestamp"], latest_insert and latest_insert["_id"])
+
+    async def get_validator(self, query_filter, count=True):
+        """Get the validator for the events matching a filter: their newest timestamp and count, and the current
+        update sequence.  The last modified time is the newer of the newest timestamp and the most recent write.
+
+        If 'count' isn't set, the events aren't counted, and their oldest timestamp is used instead.
+        """
+
+        query_filter = self._storage_filter(query_filter)
+        hint = guardrails.count_hint(query_filter)
+
+        async with self.monitor.track("get_validator", query_filter, hint):
+            latest_event = await self.events.find_one(query_filter, {"timestamp": 1}, sort=[("timestamp", -1)],
+                                                      max_time_ms=config.QUERY_MAX_TIME_MS)
+            latest_write = await self.events.find_one({}, {"updated_at": 1}, sort=[("update_seq", -1)],
+                                                      max_time_ms=config.QUERY_MAX_TIME_MS)
+
+            if count:
+                count = await self.events.count_documents(query_filter,
+                                                          **guardrails.query_options(config.QUERY_MAX_TIME_MS, hint))
+                oldest = None
+
+            else:
+                count = None
+                oldest_event = await self.events.find_one(query_filter, {"timestamp": 1}, sort=[("timestamp", 1)],
+                                                          max_time_ms=config.QUERY_MAX_TIME_MS)
+                oldest = oldest_event and oldest_event.get("timestamp")
+
+            update_seq = await changes.get_current_sequence(self.db)
+
+        last_modified = max([event[field] for (event, field) in [(latest_event, "timestamp"),
+                                                                 (latest_write, "updated_at")]
+                             if event and event.get(field)], default=None)
+
+        return conditional.Validator(last_modified, count, update_seq, oldest)
+
+    async def get_index_report(self):
+        """Report missing, unused and unexpected indexes on the events collection."""
+
+        return await index_manager.get_index_report(self.events, storage.get_event_indexes(config.EVENTS_STORAGE_MODE))
+
+    async def explain(self, query_filter, limit=None, sort=pagination.SORT_ORDER, hint=None, execute=False):
+        """Explain how the database plans a query for a page of events, or executes it if 'execute' is set."""
+
+        command = {"find": self.events.name, "filter": self._storage_filter(query_filter), "sort": dict(sort)}
+
+        if limit:
+            command["limit"] = limit
+
+        if hint:
+            command["hint"] = hint
+
+        explain_output = await self.db.command("explain", command,
+                                               verbosity="executionStats" if execute else "queryPlanner")
+
+        return index_manager.summarize_explain(explain_output)
+
+    def _storage_filter(self, query_filter):
+        """Rewrite a filter for the events collection's storage mode."""
+
+        return storage.to_storage_filter(query_filter, config.EVENTS_STORAGE_MODE)
+
+    def get_query_metrics(self):
+        """Get the query counts per query, and the most recent slow queries."""
+
+        return {
+            "metrics": self.monitor.metrics,
+            "slow_queries": list(self.monitor.slow_queries),
+        }
+
+
+def get_event_repository(command_center_db=Depends(database.get_database)):
+    """A dependency that returns an EventRepository using the application's shared client."""
+
+    return EventRepository(command_center_db)
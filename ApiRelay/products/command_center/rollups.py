@@ -0,0 +1,196 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to read and maintain pre-aggregated event counts for Command Center.
+
+The importers increment a count in the 'event_rollups' collection for every event they store, keyed by the
+event's 5 minute bucket, product, event name and source IP.  Events over time are then read from the rollups
+for every complete bucket, and only the partial buckets at either end of the timeframe are counted from the
+raw events.  Each rollup also stores its source IP as a number ('src_ip_num'), so that CIDR filters work on
+both.
+"""
+
+import pymongo
+
+from collections import Counter
+from datetime import datetime, timedelta
+from pymongo import IndexModel
+
+from products.command_center import storage
+from products.command_center.guardrails import query_options
+from products.command_center.index_manager import EVENT_RETENTION_SECONDS
+from products.command_center.pagination import from_epoch_millis, to_epoch_millis
+
+# The 'migrations' document that records the rollups have been backfilled from the events
+BACKFILL_MARKER_ID = "event_rollups_backfill"
+
+# The size of each rollup bucket, which must match the importers
+BUCKET_MINUTES = 5
+BUCKET_MS = 1000 * 60 * BUCKET_MINUTES
+
+# The granularity (in minutes) to use for timeframes (in hours) up to a maximum, or for any longer timeframe
+AUTO_GRANULARITIES = [
+    (24, 5),
+    (72, 15),
+    (168, 60),
+    (None, 240),
+]
+
+# The fields, along with the bucket, that event counts are rolled up by
+ROLLUP_FIELDS = ["product", "event_name", "src_ip"]
+
+ROLLUP_INDEXES = [
+    # Expire rollups along with the events they count
+    IndexModel([("bucket", pymongo.ASCENDING)],
+               name="bucket_1", expireAfterSeconds=EVENT_RETENTION_SECONDS),
+
+    # Product filters
+    IndexModel([("product", pymongo.ASCENDING), ("bucket", pymongo.ASCENDING)],
+               name="product_1_bucket_1"),
+
+    # Source IP range (CIDR) filters
+    IndexModel([("src_ip_num", pymongo.ASCENDING), ("bucket", pymongo.ASCENDING)],
+               name="src_ip_num_1_bucket_1"),
+]
+
+
+def bucket_start(timestamp):
+    """Get the start of the bucket that the provided timestamp falls in."""
+
+    millis = to_epoch_millis(timestamp)
+
+    return from_epoch_millis(millis - millis % BUCKET_MS)
+
+
+def _bucket_group(date_field, granularity, group_by):
+    """Build the $group key for bucketing events by the granularity (in minutes), and optionally a series field."""
+
+    group_key = {"bucket": {"$dateTrunc": {"date": date_field, "unit": "minute", "binSize": granularity}}}
+
+    if group_by:
+        group_key["series"] = f"${group_by}"
+
+    return group_key
+
+
+def _raw_event_counts(command_center_events, query_filter, granularity, group_by, max_time_ms=None):
+    """Count raw events into buckets."""
+
+    return command_center_events.aggregate([
+        {"$match": query_filter},
+        {"$group": {"_id": _bucket_group("$timestamp", granularity, group_by), "count": {"$sum": 1}}},
+    ], **query_options(max_time_ms))
+
+
+def _rollup_event_counts(command_center_rollups, query_filter, granularity, group_by, max_time_ms=None):
+    """Sum rolled up event counts into buckets."""
+
+    return command_center_rollups.aggregate([
+        {"$match": query_filter},
+        {"$group": {"_id": _bucket_group("$bucket", granularity, group_by), "count": {"$sum": "$count"}}},
+    ], **query_options(max_time_ms))
+
+
+async def get_event_counts(command_center_db, start=None, filters=None, granularity=BUCKET_MINUTES, group_by=None,
+                           max_time_ms=None, storage_mode=storage.STANDARD):
+    """Get event counts per bucket, from 'start' until now, for events matching the equality filters.
+
+    Buckets are 'granularity' minutes wide, which must be a multiple of the rollup bucket size.  If 'group_by' is
+    one of the ROLLUP_FIELDS, each count also has a 'series' with that field's value.  Each aggregation is aborted
+    after 'max_time_ms'.  The raw events filter is rewritten for the events collection's 'storage_mode'.
+    """
+
+    filters = filters or {}
+
+    # Rollups are only complete for buckets that are entirely inside the timeframe, and are already closed
+    open_bucket = bucket_start(datetime.utcnow())
+
+    if start:
+        first_bucket = bucket_start(start)
+
+        # If the timeframe starts part way through a bucket, the first complete bucket is the next one
+        if first_bucket < start:
+            first_bucket += timedelta(milliseconds=BUCKET_MS)
+
+        raw_ranges = [{"timestamp": {"$gte": start, "$lt": min(first_bucket, open_bucket)}}]
+        rollup_range = {"$gte": first_bucket, "$lt": open_bucket}
+
+    else:
+        raw_ranges = []
+        rollup_range = {"$lt": open_bucket}
+
+    # Always count the open bucket from the raw events
+    raw_ranges.append({"timestamp": {"$gte": open_bucket}})
+
+    event_counts = Counter()
+
+    # Read the complete buckets from the rollups
+    async for bucket in _rollup_event_counts(command_center_db["event_rollups"], {**filters, "bucket": rollup_range},
+                                             granularity, group_by, max_time_ms):
+        event_counts[(bucket["_id"].get("series"), bucket["_id"]["bucket"])] += bucket["count"]
+
+    # Count the partial buckets from the raw events
+    async for bucket in _raw_event_counts(command_center_db["events"],
+                                          storage.to_storage_filter({**filters, "$or": raw_ranges}, storage_mode),
+                                          granularity, group_by, max_time_ms):
+        event_counts[(bucket["_id"].get("series"), bucket["_id"]["bucket"])] += bucket["count"]
+
+    return [_event_count(series, bucket, count, group_by)
+            for ((series, bucket), count) in sorted(event_counts.items(), key=lambda item: item[0][1])
+            if count > 0]
+
+
+def _event_count(series, bucket, count, group_by):
+    """Build an event count in the response format."""
+
+    event_count = {"_id": bucket, "count": count}
+
+    if group_by:
+        event_count["series"] = series
+
+    return event_count
+
+
+def get_granularity(timeframe):
+    """Pick a granularity (in minutes) that keeps the number of buckets in a timeframe (in hours) reasonable."""
+
+    for (max_timeframe, granularity) in AUTO_GRANULARITIES:
+        if max_timeframe is None or (timeframe and timeframe <= max_timeframe):
+            return granularity
+
+
+async def is_backfilled(command_center_db):
+    """Check whether the rollups have been backfilled from the events.
+
+    The importers write rollups as soon as they run, so an empty rollups collection can't be relied on to tell.
+    """
+
+    return bool(await command_center_db["migrations"].find_one({"_id": BACKFILL_MARKER_ID}))
+
+
+async def backfill(command_center_db):
+    """Rebuild the rollups from the raw events, for instance when the rollups collection is first created."""
+
+    # The $merge stage writes the rollups, so the cursor it returns is always empty
+    await command_center_db["events"].aggregate([
+        {"$group": {
+            "_id": {
+                "bucket": {"$toDate": {"$subtract": [{"$toLong": "$timestamp"},
+                                                     {"$mod": [{"$toLong": "$timestamp"}, BUCKET_MS]}]}},
+                "product": "$product",
+                "event_name": "$event_name",
+                "src_ip": "$src_ip",
+            },
+            "count": {"$sum": 1},
+            "src_ip_num": {"$first": "$src_ip_num"}}},
+        {"$addFields": {
+            "bucket": "$_id.bucket",
+            "product": "$_id.product",
+            "event_name": "$_id.event_name",
+            "src_ip": "$_id.src_ip"}},
+        {"$merge": {"into": "event_rollups", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ], allowDiskUse=True).to_list(length=None)
+
+    # Record that the backfill finished, so it isn't repeated
+    await command_center_db["migrations"].update_one({"_id": BACKFILL_MARKER_ID},
+                                                     {"$set": {"completed_at": datetime.utcnow()}}, upsert=True)
@@ -0,0 +1,163 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to manage how the Command Center events are stored.
+
+In the default 'standard' storage mode, 'events' is a plain collection, and events are expired by a TTL index.
+In the 'timeseries' storage mode, 'events' is a MongoDB time series collection, which stores events in compressed
+buckets per product and source IP (the 'meta' field the importers add), and expires whole buckets itself.  Filters
+on the product and source IP are rewritten to filter on 'meta', so that MongoDB can skip whole buckets rather than
+decompressing them.
+
+Time series collections need MongoDB 7.0 or later, since Stealthwatch events are replaced as they're updated,
+and have some limitations:
+
+- They can't have unique indexes.
+- They don't support change streams, so live events are polled for instead.
+- They don't support text indexes.
+- They don't have an '_id' index, so one is created as a secondary index.
+"""
+
+import pymongo
+
+from pymongo import IndexModel
+from pymongo.errors import CollectionInvalid
+
+from products.command_center.index_manager import EVENT_INDEXES, EVENT_RETENTION_SECONDS
+
+STANDARD = "standard"
+TIMESERIES = "timeseries"
+
+# The fields grouped into the 'meta' field of time series events
+META_FIELDS = ["product", "src_ip"]
+
+TIMESERIES_OPTIONS = {
+    "timeField": "timestamp",
+    "metaField": "meta",
+    "granularity": "minutes",
+}
+
+TIMESERIES_EVENT_INDEXES = [
+    # Time series collections expire events themselves, can't have text or unique indexes, and don't index '_id'
+    *[index for index in EVENT_INDEXES if index.document["name"] not in ["timestamp_1", "event_text", "event_key_1"]],
+    IndexModel([("_id", pymongo.ASCENDING)], name="_id_1"),
+    IndexModel([("event_key", pymongo.ASCENDING)], name="event_key_1"),
+
+    # Product and source IP filters, which are rewritten to filter on 'meta'
+    IndexModel([("meta.product", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)],
+               name="meta.product_1_timestamp_-1"),
+    IndexModel([("meta.src_ip", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)],
+               name="meta.src_ip_1_timestamp_-1"),
+]
+
+
+def get_event_indexes(storage_mode):
+    """Get the indexes the events collection should have in a storage mode."""
+
+    return TIMESERIES_EVENT_INDEXES if storage_mode == TIMESERIES else EVENT_INDEXES
+
+
+def to_storage_filter(query_filter, storage_mode):
+    """Rewrite a filter on the fields grouped into 'meta' to filter on 'meta' instead, in the time series mode."""
+
+    if storage_mode != TIMESERIES or not query_filter:
+        return query_filter
+
+    storage_filter = {}
+
+    for (field, value) in query_filter.items():
+
+        if field in ["$and", "$or", "$nor"]:
+            value = [to_storage_filter(clause, storage_mode) for clause in value]
+
+        elif field in META_FIELDS:
+            field = f"meta.{field}"
+
+        storage_filter[field] = value
+
+    return storage_filter
+
+
+def add_meta(event):
+    """Add the 'meta' field that time series buckets are grouped by to an event."""
+
+    event["meta"] = {field: event.get(field) for field in META_FIELDS}
+
+    return event
+
+
+async def is_timeseries(command_center_db, name="events"):
+    """Check whether a collection is a time series collection."""
+
+    collections = await command_center_db.list_collections(filter={"name": name}).to_list(length=None)
+
+    return bool(collections) and collections[0].get("type") == "timeseries"
+
+
+async def create_timeseries_collection(command_center_db, name="events"):
+    """Create a time series collection for events, which expires them after the retention period."""
+
+    await command_center_db.create_collection(name, timeseries=TIMESERIES_OPTIONS,
+                                              expireAfterSeconds=EVENT_RETENTION_SECONDS)
+
+
+async def ensure_collection(command_center_db, storage_mode):
+    """Make sure the events collection exists in the storage mode, and report if it needs migrating."""
+
+    if storage_mode != TIMESERIES:
+        return
+
+    try:
+        await create_timeseries_collection(command_center_db)
+        print("Created the 'events' time series collection")
+
+    # The collection already exists, so make sure it's the right kind
+    except CollectionInvalid:
+        if not await is_timeseries(command_center_db):
+            print("The 'events' collection isn't a time series collection.  Run the migration tool to convert it: "
+                  "python -m migrations.migrate_events_to_timeseries")
+
+
+async def migrate_to_timeseries(command_center_db, batch_size=1000, legacy_name="events_legacy"):
+    """Convert the events collection into a time series collection, keeping the original as 'legacy_name'.
+
+    The original collection is renamed, a time series collection is created in its place, and the events are
+    copied into it in batches, with their 'meta' field added.  Time series collections can't be renamed, so the
+    importers should be stopped while this runs, or their writes may recreate a plain 'events' collection first.
+    Returns the number of events copied.
+    """
+
+    if await is_timeseries(command_center_db):
+        print("The 'events' collection is already a time series collection")
+        return 0
+
+    # Move the original collection aside, so that the importers write to the new collection from now on
+    if await command_center_db.list_collection_names(filter={"name": "events"}):
+        await command_center_db["events"].rename(legacy_name)
+
+    await create_timeseries_collection(command_center_db)
+
+    copied = 0
+    batch = []
+
+    async for event in command_center_db[legacy_name].find().sort("_id", pymongo.ASCENDING):
+        batch.append(add_meta(event))
+
+        if len(batch) >= batch_size:
+            copied += await _insert_batch(command_center_db["events"], batch)
+            batch = []
+
+    if batch:
+        copied += await _insert_batch(command_center_db["events"], batch)
+
+    return copied
+
+
+async def _insert_batch(command_center_events, batch):
+    """Insert a batch of events, and return the number inserted."""
+
+    result = await command_center_events.insert_many(batch, ordered=False)
+
+    print(f"Copied {len(result.inserted_ids)} events")
+
+    return len(result.inserted_ids)
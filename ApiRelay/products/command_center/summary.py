@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This is a Python module to summarize Command Center events for the dashboard widgets.
+
+The totals per product, top event names and top source IPs are all computed in a single '$facet' aggregation, so
+the events matching the filter are only scanned once, and only the counts are sent to the client.
+"""
+
+from products.command_center.guardrails import query_options
+
+# The fields that are summarized, and the key each summary is returned under
+SUMMARY_FIELDS = [
+    ("product", "products"),
+    ("event_name", "event_names"),
+    ("src_ip", "src_ips"),
+]
+
+
+def build_pipeline(query_filter, top=25, with_total=True):
+    """Build the '$facet' aggregation pipeline that summarizes the events matching a filter."""
+
+    facets = {}
+
+    if with_total:
+        facets["total"] = [{"$count": "count"}]
+
+    for (field, name) in SUMMARY_FIELDS:
+        facets[name] = [{"$sortByCount": f"${field}"}]
+
+        # Every product is returned, since there are only a handful of them
+        if field != "product":
+            facets[name].append({"$limit": top})
+
+    return [{"$match": query_filter}, {"$facet": facets}]
+
+
+async def get_summary(command_center_events, query_filter, top=25, fast_totals=False, max_time_ms=None, hint=None):
+    """Get the total, and the event counts per product, top event names and top source IPs for a filter.
+
+    If 'fast_totals' is set and the filter is empty, the total is taken from the collection metadata, which is an
+    estimate, rather than counted.  The aggregation is aborted after 'max_time_ms', and uses the 'hint' index.
+    """
+
+    fast_total = fast_totals and not query_filter
+
+    pipeline = build_pipeline(query_filter, top=top, with_total=not fast_total)
+
+    # A '$facet' stage always returns a single document
+    facets = (await command_center_events.aggregate(pipeline, **query_options(max_time_ms, hint))
+                                         .to_list(length=None))[0]
+
+    if fast_total:
+        total = await command_center_events.estimated_document_count()
+    else:
+        total = facets["total"][0]["count"] if facets["total"] else 0
+
+    summary = {
+        "total": total,
+        "total_estimated": fast_total,
+    }
+
+    for (_, name) in SUMMARY_FIELDS:
+        summary[name] = [{"name": facet["_id"], "count": facet["count"]} for facet in facets[name]]
+
+    return summary
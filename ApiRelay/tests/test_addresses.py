@@ -0,0 +1,31 @@
+import pytest
+
+from bson.binary import Binary
+
+from products.command_center import addresses
+
+
+def test_to_ip_number():
+    assert addresses.to_ip_number("10.20.0.1") == 0x0A140001
+    assert addresses.to_ip_number("2001:db8::1") == Binary(bytes.fromhex("20010db8000000000000000000000001"))
+    assert addresses.to_ip_number("not an ip") is None
+    assert addresses.to_ip_number(None) is None
+
+
+def test_cidr_filter_ipv4():
+    assert addresses.cidr_filter("10.20.0.0/16") == {"src_ip_num": {"$gte": 0x0A140000, "$lte": 0x0A14FFFF}}
+
+    # Host bits are ignored
+    assert addresses.cidr_filter("10.20.30.40/16") == addresses.cidr_filter("10.20.0.0/16")
+
+
+def test_cidr_filter_ipv6():
+    src_ip_range = addresses.cidr_filter("2001:db8::/32")["src_ip_num"]
+
+    assert src_ip_range["$gte"] == Binary(bytes.fromhex("20010db8" + "00" * 12))
+    assert src_ip_range["$lte"] == Binary(bytes.fromhex("20010db8" + "ff" * 12))
+
+
+def test_cidr_filter_invalid():
+    with pytest.raises(addresses.InvalidCidr):
+        addresses.cidr_filter("10.20.0.0/33")
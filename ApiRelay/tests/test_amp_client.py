@@ -0,0 +1,67 @@
+from modules.cisco_amp.amp_client import AmpClient
+
+
+class FakeAmpClient(AmpClient):
+
+    def __init__(self, items, with_total=True):
+        super().__init__(client_id="client", api_key="key")
+        self.items = items
+        self.with_total = with_total
+        self.urls = []
+
+    def _get_request(self, url=None):
+        self.urls.append(url)
+
+        query = dict(parameter.split("=") for parameter in url.split("?")[1].split("&") if parameter)
+        (limit, offset) = (int(query["limit"]), int(query["offset"]))
+
+        metadata = {"results": {"current_item_count": len(self.items[offset:offset + limit])}, "links": {}}
+
+        if self.with_total:
+            metadata["results"]["total"] = len(self.items)
+        elif offset + limit < len(self.items):
+            metadata["links"]["next"] = f"https://amp/v1/events?&limit={limit}&offset={offset + limit}"
+
+        return {"metadata": metadata, "data": self.items[offset:offset + limit]}
+
+
+def test_paginated_data_fetches_pages_by_offset_in_order():
+    client = FakeAmpClient(list(range(25)))
+
+    assert client._get_paginated_data("https://amp/v1/events?", limit=10) == list(range(25))
+    assert len(client.urls) == 3
+
+
+def test_paginated_data_follows_next_links_without_total():
+    client = FakeAmpClient(list(range(25)), with_total=False)
+
+    pages = list(client._iter_paginated_data("https://amp/v1/events?", limit=10))
+
+    assert pages == [list(range(10)), list(range(10, 20)), list(range(20, 25))]
+
+
+def test_paginated_data_single_page():
+    client = FakeAmpClient(list(range(5)))
+
+    assert client._get_paginated_data("https://amp/v1/events?", limit=10) == list(range(5))
+    assert len(client.urls) == 1
+
+
+class GrowingAmpClient(FakeAmpClient):
+
+    def _get_request(self, url=None):
+        response = super()._get_request(url)
+
+        # Ten newer events arrive after the first page, pushing the oldest events past the first total
+        if len(self.urls) == 1:
+            self.items[:0] = list(range(100, 110))
+
+        return response
+
+
+def test_paginated_data_fetches_past_total_when_events_arrive():
+    client = GrowingAmpClient(list(range(25)))
+
+    data = client._get_paginated_data("https://amp/v1/events?", limit=10)
+
+    assert set(range(25)) <= set(data)
@@ -9,3 +9,10 @@ def test_read_main():
     response = client.get("/ping")
     assert response.status_code == 200
     assert response.json() == {'pong!'}
+
+
+def test_shared_db_client_lifespan():
+    with TestClient(app) as lifespan_client:
+        db_client = app.state.db_client
+        assert db_client is not None
+        assert lifespan_client.app.state.db_client is db_client
@@ -0,0 +1,118 @@
+import asyncio
+
+from products.command_center.cache import EventCache, ResponseCache
+
+
+def returning(*values):
+    values = iter(values)
+
+    async def compute():
+        return next(values)
+
+    return compute
+
+
+def test_cached_until_ttl():
+    response_cache = ResponseCache(ttl=60, stale_ttl=60)
+    compute = returning(1, 2)
+
+    async def run():
+        return [await response_cache.get("key", compute, returning("watermark", "watermark")) for _ in range(2)]
+
+    assert asyncio.run(run()) == [1, 1]
+
+
+def test_newer_watermark_invalidates():
+    response_cache = ResponseCache(ttl=60, stale_ttl=60, watermark_interval=0)
+    compute = returning(1, 2)
+    get_watermark = returning("old", "new")
+
+    async def run():
+        return [await response_cache.get("key", compute, get_watermark) for _ in range(2)]
+
+    assert asyncio.run(run()) == [1, 2]
+
+
+def test_least_recently_used_evicted():
+    response_cache = ResponseCache(max_entries=2, ttl=60, stale_ttl=60)
+    no_watermark = returning(*[None] * 10)
+
+    async def run():
+        await response_cache.get("a", returning("a"), no_watermark)
+        await response_cache.get("b", returning("b"), no_watermark)
+        await response_cache.get("a", returning("unused"), no_watermark)
+        await response_cache.get("c", returning("c"), no_watermark)
+
+        return (await response_cache.get("a", returning("recomputed"), no_watermark),
+                await response_cache.get("b", returning("recomputed"), no_watermark))
+
+    assert asyncio.run(run()) == ("a", "recomputed")
+
+
+def test_stale_served_while_revalidating():
+    response_cache = ResponseCache(ttl=0, stale_ttl=60)
+    no_watermark = returning(*[None] * 10)
+
+    async def run():
+        await response_cache.get("key", returning("old"), no_watermark)
+        stale = await response_cache.get("key", returning("new"), no_watermark)
+
+        # Let the background refresh finish
+        await asyncio.sleep(0)
+
+        return (stale, response_cache._entries["key"].value)
+
+    assert asyncio.run(run()) == ("old", "new")
+
+
+def test_concurrent_requests_coalesced():
+    response_cache = ResponseCache(ttl=60, stale_ttl=60)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "value"
+
+    async def run():
+        return await asyncio.gather(*[response_cache.get("key", compute, returning(None)) for _ in range(5)])
+
+    assert asyncio.run(run()) == ["value"] * 5
+    assert len(calls) == 1
+
+
+def test_event_cache_evicts_least_recently_used():
+    event_cache = EventCache(max_entries=2)
+
+    for event_id in [1, 2]:
+        event_cache.put({"_id": event_id, "product": "Umbrella"})
+
+    event_cache.get(1)
+    event_cache.put({"_id": 3, "product": "Umbrella"})
+
+    assert event_cache.get(1) is not None
+    assert event_cache.get(2) is None
+    assert event_cache.get(3) is not None
+
+
+def test_event_cache_expires_mutable_events():
+    event_cache = EventCache(mutable_ttl=0)
+
+    event_cache.put({"_id": 1, "product": "Stealthwatch"})
+    event_cache.put({"_id": 2, "product": "Umbrella"})
+
+    assert event_cache.get(1) is None
+    assert event_cache.get(2) is not None
+
+    event_cache.invalidate(2)
+
+    assert event_cache.get(2) is None
+
+
+def test_event_cache_update_seqs_of_mutable_events():
+    event_cache = EventCache()
+
+    event_cache.put({"_id": 1, "product": "Stealthwatch"}, 7)
+    event_cache.put({"_id": 2, "product": "Umbrella"}, 8)
+
+    assert event_cache.get_update_seqs([1, 2, 3]) == {1: 7}
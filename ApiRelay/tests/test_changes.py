@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from datetime import datetime, timedelta
+
+from products.command_center import changes
+
+
+class FakeCursor(object):
+
+    def __init__(self, results):
+        self.results = results
+
+    def sort(self, *args):
+        return self
+
+    def limit(self, limit):
+        self.results = self.results[:limit]
+        return self
+
+    def max_time_ms(self, max_time_ms):
+        return self
+
+    async def to_list(self, length=None):
+        return self.results
+
+
+class FakeCollection(object):
+
+    def __init__(self, results, latest_changes=None):
+        self.results = results
+        self.latest_changes = latest_changes
+        self.query_filter = None
+
+    def find(self, query_filter, projection=None):
+        # The latest changes to any event are looked up for just their sync fields
+        if projection == {"update_seq": 1, "updated_at": 1}:
+            return FakeCursor(self.latest_changes)
+
+        self.query_filter = query_filter
+        return FakeCursor(self.results)
+
+
+def test_token_round_trip():
+    assert changes.decode_token(changes.encode_token(42)) == 42
+
+
+def test_invalid_token():
+    with pytest.raises(changes.InvalidSyncToken):
+        changes.decode_token("not a token")
+
+
+@pytest.mark.parametrize("update_seq", [-1, 2 ** 63])
+def test_out_of_range_token(update_seq):
+    with pytest.raises(changes.InvalidSyncToken):
+        changes.decode_token(changes.encode_token(update_seq))
+
+
+def test_get_changes_classifies_and_only_advances_past_settled_changes():
+    settled = datetime.utcnow() - timedelta(minutes=5)
+    settling = datetime.utcnow()
+
+    events = FakeCollection([
+        {"_id": 1, "insert_seq": 11, "update_seq": 11, "updated_at": settled},
+        {"_id": 2, "insert_seq": 3, "update_seq": 12, "updated_at": settled},
+        {"_id": 3, "insert_seq": 13, "update_seq": 13, "updated_at": settling},
+        {"_id": 4, "insert_seq": 14, "update_seq": 14, "updated_at": settled},
+    ])
+
+    (inserted, updated, next_since, has_more) = asyncio.run(changes.get_changes(events, 10, {"product": "Umbrella"},
+                                                                                limit=3, settle_seconds=10))
+
+    assert events.query_filter == {"product": "Umbrella", "update_seq": {"$gt": 10}}
+    assert [event["_id"] for event in inserted] == [1, 3]
+    assert updated == [{"_id": 2}]
+    assert next_since == 12
+    assert has_more
+
+
+def test_get_changes_has_no_more_when_the_first_change_is_settling():
+    settling = datetime.utcnow()
+
+    events = FakeCollection([
+        {"_id": 1, "insert_seq": 11, "update_seq": 11, "updated_at": settling},
+        {"_id": 2, "insert_seq": 12, "update_seq": 12, "updated_at": settling},
+    ])
+
+    (inserted, updated, next_since, has_more) = asyncio.run(changes.get_changes(events, 10, limit=1))
+
+    assert [event["_id"] for event in inserted] == [1]
+    assert next_since == 10
+    assert not has_more
+
+
+def test_filtered_get_changes_advances_past_settled_changes_it_did_not_match():
+    settled = datetime.utcnow() - timedelta(minutes=5)
+    settling = datetime.utcnow()
+
+    events = FakeCollection([{"_id": 1, "insert_seq": 11, "update_seq": 11, "updated_at": settled}],
+                            latest_changes=[
+                                {"update_seq": 15, "updated_at": settling},
+                                {"update_seq": 14, "updated_at": settled},
+                                {"update_seq": 13, "updated_at": settled},
+                            ])
+
+    (inserted, updated, next_since, has_more) = asyncio.run(changes.get_changes(events, 10, {"product": "Umbrella"},
+                                                                                limit=3, settle_seconds=10))
+
+    assert [event["_id"] for event in inserted] == [1]
+    assert next_since == 14
+    assert not has_more
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from products.command_center import columnar
+
+
+def test_dictionary_encode():
+    assert columnar.dictionary_encode(["a", "b", "a", None]) == {"dictionary": ["a", "b", None],
+                                                                 "indexes": [0, 1, 0, 2]}
+
+
+def test_to_columns():
+    events = [
+        {"_id": ObjectId("5eab0e8a0000000000000001"), "product": "Umbrella", "src_ip": "10.0.0.1",
+         "timestamp": datetime(2020, 5, 1)},
+        {"_id": ObjectId("5eab0e8a0000000000000002"), "product": "Umbrella", "src_ip": "10.0.0.2",
+         "timestamp": datetime(2020, 5, 1, 0, 0, 1)},
+    ]
+
+    columns = columnar.to_columns(events, ["product", "src_ip", "timestamp"])
+
+    assert columns == {
+        "_id": ["5eab0e8a0000000000000001", "5eab0e8a0000000000000002"],
+        "product": {"dictionary": ["Umbrella"], "indexes": [0, 0]},
+        "src_ip": ["10.0.0.1", "10.0.0.2"],
+        "timestamp": [1588291200000, 1588291201000],
+    }
@@ -0,0 +1,147 @@
+import json
+
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from datetime import datetime
+from fastapi.testclient import TestClient
+
+from pymongo.errors import ExecutionTimeout
+
+from app import app
+from products.command_center import command_center, conditional, pagination
+from products.command_center.repository import get_event_repository
+
+EVENT = {
+    "_id": ObjectId(),
+    "event_name": "Threat Detected",
+    "product": "AMP for Endpoints",
+    "src_ip": "2001:db8::1",
+    "timestamp": datetime(2020, 5, 1, 12, 30),
+    "src_ip_num": Binary(bytes(16)),
+    "event_key": "amp-1",
+    "insert_seq": 1,
+    "update_seq": 1,
+    "updated_at": datetime(2020, 5, 1, 12, 30),
+    "meta": {"product": "AMP for Endpoints", "src_ip": "2001:db8::1"},
+}
+
+FLOW = {
+    "_id": ObjectId(),
+    "event_name": "Stealthwatch Alarm",
+    "product": "Stealthwatch",
+    "src_ip": "10.0.0.1",
+    "timestamp": datetime(2020, 5, 1, 12, 30),
+    "insert_seq": 2,
+    "update_seq": 2,
+}
+
+
+class FakeRepository(object):
+
+    events = [EVENT]
+    validated = []
+    stream_timeout = False
+
+    async def find_page(self, query_filter, projection=None, limit=None, sort=None):
+        return [{field: EVENT[field] for field in projection if field in EVENT}]
+
+    async def stream(self, query_filter, projection=None, batch_size=None, sort=None):
+        for index in range(3):
+            yield {**EVENT, "_id": ObjectId(), "event_name": f"Threat Detected {index}"}
+
+        if FakeRepository.stream_timeout:
+            raise ExecutionTimeout("operation exceeded time limit")
+
+    async def get_validator(self, query_filter, count=True):
+        FakeRepository.validated.append((query_filter, count))
+
+        return conditional.Validator(EVENT["timestamp"], 1 if count else None, 1)
+
+    async def get_watermark(self):
+        return (EVENT["timestamp"], EVENT["_id"])
+
+    async def find_by_ids(self, event_ids, projection=None):
+        excluded = [field for (field, value) in (projection or {}).items() if not value]
+
+        return [{field: value for (field, value) in event.items() if field not in excluded}
+                for event in FakeRepository.events if event["_id"] in event_ids]
+
+    async def get_update_seqs(self, event_ids):
+        return {event["_id"]: event["update_seq"] for event in FakeRepository.events if event["_id"] in event_ids}
+
+
+def setup_function():
+    FakeRepository.events = [EVENT]
+    FakeRepository.stream_timeout = False
+    FakeRepository.validated.clear()
+    command_center.event_cache.clear()
+    command_center.response_cache.clear()
+    app.dependency_overrides[get_event_repository] = FakeRepository
+
+
+def teardown_function():
+    app.dependency_overrides.clear()
+
+
+def test_event_leaves_out_internal_fields():
+    response = TestClient(app).get(f"/command-center/event/{EVENT['_id']}")
+
+    assert response.status_code == 200
+    assert response.json()["event"][0]["event_name"] == "Threat Detected"
+    assert not set(command_center.INTERNAL_FIELDS) & set(response.json()["event"][0])
+
+
+def test_events_batch_leaves_out_internal_fields():
+    response = TestClient(app).post("/command-center/events/batch", json={"ids": [str(EVENT["_id"])]})
+
+    assert response.status_code == 200
+    assert not set(command_center.INTERNAL_FIELDS) & set(response.json()["events"][0])
+
+
+def test_only_first_events_page_is_validated():
+    client = TestClient(app)
+
+    first_page = client.get("/command-center/events", params={"timeframe": 24})
+    next_page = client.get("/command-center/events", params={"timeframe": 24,
+                                                              "cursor": pagination.encode_cursor(EVENT)})
+
+    assert "ETag" in first_page.headers
+    assert "ETag" not in next_page.headers
+    assert next_page.json()["events"][0]["event_name"] == "Threat Detected"
+    assert len(FakeRepository.validated) == 1
+
+
+def test_updated_event_is_not_served_from_cache():
+    client = TestClient(app)
+    FakeRepository.events = [EVENT, FLOW]
+
+    first = client.get(f"/command-center/event/{FLOW['_id']}")
+    FakeRepository.events = [EVENT, {**FLOW, "event_name": "Stealthwatch Alarm Updated", "update_seq": 3}]
+    second = client.get(f"/command-center/event/{FLOW['_id']}")
+
+    assert first.json()["event"][0]["event_name"] == "Stealthwatch Alarm"
+    assert second.json()["event"][0]["event_name"] == "Stealthwatch Alarm Updated"
+    assert "update_seq" not in second.json()["event"][0]
+
+
+def test_truncated_stream_ends_with_marker(monkeypatch):
+    monkeypatch.setattr(command_center.config, "EVENTS_STREAM_MAX_DOCUMENTS", 2)
+
+    response = TestClient(app).get("/command-center/events", params={"timeframe": 24, "stream": True})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert [line.get("event_name") for line in lines[:2]] == ["Threat Detected 0", "Threat Detected 1"]
+    assert lines[2]["status"] == "truncated"
+    assert lines[2]["reason"] == "max_documents"
+    assert pagination.keyset_filter(lines[2]["next_cursor"])
+
+
+def test_timed_out_stream_ends_with_marker():
+    FakeRepository.stream_timeout = True
+
+    response = TestClient(app).get("/command-center/events", params={"timeframe": 24, "stream": True})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert len(lines) == 4
+    assert lines[3]["reason"] == "timeout"
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from products.command_center import conditional
+
+VALIDATOR = conditional.Validator(datetime(2020, 5, 1, 12, 30, 15, 500000), 42, 7)
+
+
+def test_get_headers():
+    headers = conditional.get_headers(VALIDATOR)
+
+    assert headers["ETag"].startswith('W/"')
+    assert headers["Last-Modified"] == "Fri, 01 May 2020 12:30:15 GMT"
+    assert headers["Cache-Control"] == "no-cache"
+
+
+def test_etag_changes_with_validator():
+    assert conditional.make_etag(VALIDATOR) != conditional.make_etag(VALIDATOR._replace(update_seq=8))
+
+
+def test_if_none_match():
+    etag = conditional.make_etag(VALIDATOR)
+
+    assert conditional.is_not_modified({"if-none-match": etag}, VALIDATOR)
+    assert conditional.is_not_modified({"if-none-match": f'"other", {etag[2:]}'}, VALIDATOR)
+    assert not conditional.is_not_modified({"if-none-match": '"other"'}, VALIDATOR)
+
+    # If-None-Match takes precedence over If-Modified-Since
+    assert not conditional.is_not_modified({"if-none-match": '"other"',
+                                            "if-modified-since": "Fri, 01 May 2020 12:30:15 GMT"}, VALIDATOR)
+
+
+def test_if_modified_since():
+    assert conditional.is_not_modified({"if-modified-since": "Fri, 01 May 2020 12:30:15 GMT"}, VALIDATOR)
+    assert not conditional.is_not_modified({"if-modified-since": "Fri, 01 May 2020 12:30:14 GMT"}, VALIDATOR)
+    assert not conditional.is_not_modified({"if-modified-since": "not a date"}, VALIDATOR)
+
+
+def test_if_modified_since_ignored_for_windowed_responses():
+    assert not conditional.is_not_modified({"if-modified-since": "Fri, 01 May 2020 12:30:15 GMT"}, VALIDATOR,
+                                           windowed=True)
+    assert conditional.is_not_modified({"if-none-match": conditional.make_etag(VALIDATOR)}, VALIDATOR,
+                                       windowed=True)
@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from bson import json_util
+from bson.objectid import ObjectId
+from datetime import datetime, timezone
+
+from products.command_center import encoder
+
+
+EVENT = {
+    "_id": ObjectId(),
+    "event_name": "Threat Detected",
+    "product": "AMP for Endpoints",
+    "timestamp": datetime(2020, 5, 1, 12, 30, 15, 123000),
+    "computer": {"network_addresses": [{"ip": "10.0.0.1", "mac": None}]},
+}
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(encoder, "orjson", None)
+    elif encoder.orjson is None:
+        pytest.skip("orjson is not installed")
+    return request.param
+
+
+def test_encode_matches_json_util(backend):
+    assert json.loads(encoder.encode(EVENT)) == json.loads(json_util.dumps(EVENT, json_options=json_util.LEGACY_JSON_OPTIONS))
+
+
+def test_encode_timezone_aware_datetime(backend):
+    aware = datetime(2020, 5, 1, 12, 30, 15, tzinfo=timezone.utc)
+
+    assert json.loads(encoder.encode({"timestamp": aware})) == {"timestamp": {"$date": 1588336215000}}
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from datetime import datetime
+
+from pymongo.errors import ExecutionTimeout
+
+from products.command_center import guardrails, index_manager
+
+
+class FakeCollection(object):
+
+    def __init__(self, index_names):
+        self.index_names = index_names
+
+    async def index_information(self):
+        return {name: {} for name in self.index_names}
+
+
+@pytest.fixture(autouse=True)
+def available_indexes():
+    asyncio.run(guardrails.refresh_available_indexes(
+        FakeCollection([index.document["name"] for index in index_manager.EVENT_INDEXES])))
+
+    yield
+
+    guardrails.available_indexes.clear()
+
+
+def test_page_hint_for_timeframe_only():
+    query_filter = {"timestamp": {"$gte": datetime(2020, 1, 1)}}
+    assert guardrails.page_hint(query_filter) == guardrails.SORT_HINT
+
+
+def test_page_hint_for_keyset_cursor():
+    query_filter = {"$and": [
+        {"timestamp": {"$gte": datetime(2020, 1, 1)}},
+        {"$or": [{"timestamp": {"$lt": datetime(2020, 1, 2)}},
+                 {"timestamp": datetime(2020, 1, 2), "_id": {"$lt": 1}}]},
+    ]}
+    assert guardrails.page_hint(query_filter) == guardrails.SORT_HINT
+
+
+def test_page_hint_left_to_planner_for_filters():
+    query_filter = {"timestamp": {"$gte": datetime(2020, 1, 1)}, "product": "AMP"}
+    assert guardrails.page_hint(query_filter) is None
+
+
+def test_count_hint_picks_most_selective_index():
+    query_filter = {"timestamp": {"$gte": datetime(2020, 1, 1)}, "product": "AMP", "src_ip": "10.0.0.1"}
+    assert guardrails.count_hint(query_filter) == "src_ip_1_timestamp_-1"
+
+
+def test_text_search_is_not_hinted():
+    query_filter = {"$text": {"$search": "malware"}, "timestamp": {"$gte": datetime(2020, 1, 1)}}
+    assert guardrails.page_hint(query_filter) is None
+    assert guardrails.count_hint(query_filter) is None
+
+
+def test_missing_indexes_are_not_hinted():
+    asyncio.run(guardrails.refresh_available_indexes(FakeCollection(["_id_", "product_1_timestamp_-1"])))
+
+    assert guardrails.page_hint({"timestamp": {"$gte": datetime(2020, 1, 1)}}) is None
+    assert guardrails.count_hint({"product": "AMP", "src_ip": "10.0.0.1"}) == "product_1_timestamp_-1"
+
+
+def test_query_options():
+    assert guardrails.query_options() == {}
+    assert guardrails.query_options(100, "timestamp_-1__id_-1") == {"maxTimeMS": 100, "hint": "timestamp_-1__id_-1"}
+
+
+def test_query_monitor_logs_slow_queries():
+    monitor = guardrails.QueryMonitor(slow_ms=0)
+
+    async def run():
+        async with monitor.track("find_page", {"product": "AMP"}):
+            pass
+
+    asyncio.run(run())
+
+    assert monitor.metrics["find_page"]["count"] == 1
+    assert monitor.metrics["find_page"]["slow"] == 1
+    assert monitor.slow_queries[0]["filter"] == {"product": "AMP"}
+
+
+def test_query_monitor_counts_timeouts():
+    monitor = guardrails.QueryMonitor(slow_ms=1000)
+
+    async def run():
+        async with monitor.track("summary"):
+            raise ExecutionTimeout("operation exceeded time limit")
+
+    with pytest.raises(ExecutionTimeout):
+        asyncio.run(run())
+
+    assert monitor.metrics["summary"]["timeouts"] == 1
+    assert monitor.slow_queries[0]["timed_out"]
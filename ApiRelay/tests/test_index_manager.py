@@ -0,0 +1,32 @@
+from products.command_center import index_manager
+
+
+def test_summarize_explain_index_scan():
+    explain_output = {
+        "queryPlanner": {
+            "winningPlan": {
+                "stage": "LIMIT",
+                "inputStage": {
+                    "stage": "FETCH",
+                    "inputStage": {"stage": "IXSCAN", "indexName": "product_1_timestamp_-1"},
+                },
+            },
+        },
+        "executionStats": {"nReturned": 5, "totalKeysExamined": 5, "totalDocsExamined": 5, "executionTimeMillis": 1},
+    }
+
+    summary = index_manager.summarize_explain(explain_output)
+
+    assert summary["stages"] == ["LIMIT", "FETCH", "IXSCAN"]
+    assert summary["indexes"] == ["product_1_timestamp_-1"]
+    assert not summary["collection_scan"]
+    assert summary["documents_examined"] == 5
+
+
+def test_summarize_explain_collection_scan():
+    explain_output = {"queryPlanner": {"winningPlan": {"queryPlan": {"stage": "COLLSCAN"}}}}
+
+    summary = index_manager.summarize_explain(explain_output)
+
+    assert summary["stages"] == ["COLLSCAN"]
+    assert summary["collection_scan"]
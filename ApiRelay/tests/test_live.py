@@ -0,0 +1,50 @@
+import asyncio
+
+from products.command_center.live import EventBroadcaster
+
+
+def test_publish_fans_out_to_matching_subscribers():
+    broadcaster = EventBroadcaster()
+
+    async def run():
+        broadcaster._task = asyncio.ensure_future(asyncio.sleep(60))
+
+        umbrella = broadcaster.subscribe(None, {"product": "Umbrella"})
+        everything = broadcaster.subscribe(None, {})
+
+        broadcaster.publish("insert", {"product": "Umbrella", "src_ip": "10.0.0.1"})
+        broadcaster.publish("insert", {"product": "Stealthwatch", "src_ip": "10.0.0.2"})
+
+        return (umbrella.queue.qsize(), everything.queue.qsize())
+
+    assert asyncio.run(run()) == (1, 2)
+
+
+def test_slow_subscriber_dropped():
+    broadcaster = EventBroadcaster(queue_size=2)
+
+    async def run():
+        broadcaster._task = asyncio.ensure_future(asyncio.sleep(60))
+
+        subscription = broadcaster.subscribe(None, {})
+
+        for _ in range(3):
+            broadcaster.publish("insert", {"product": "Umbrella"})
+
+        messages = [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+
+        broadcaster.unsubscribe(subscription)
+
+        return (subscription.overflowed, messages[-1], broadcaster._task)
+
+    assert asyncio.run(run()) == (True, (None, None), None)
+
+
+def test_listeners_see_every_event():
+    broadcaster = EventBroadcaster()
+    seen = []
+
+    broadcaster.add_listener(lambda operation, event: seen.append((operation, event["_id"])))
+    broadcaster.publish("replace", {"_id": 1, "product": "Stealthwatch"})
+
+    assert seen == [("replace", 1)]
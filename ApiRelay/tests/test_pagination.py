@@ -0,0 +1,44 @@
+import base64
+
+import pytest
+
+from bson.objectid import ObjectId
+from datetime import datetime
+
+from products.command_center import pagination
+
+
+def test_cursor_round_trip():
+    event = {"_id": ObjectId(), "timestamp": datetime(2020, 5, 1, 12, 30, 15, 123000)}
+
+    cursor = pagination.encode_cursor(event)
+
+    assert pagination.decode_cursor(cursor) == (event["timestamp"], event["_id"])
+
+
+def test_keyset_filter_breaks_timestamp_ties_on_id():
+    event = {"_id": ObjectId(), "timestamp": datetime(2020, 5, 1, 12, 30, 15)}
+
+    query_filter = pagination.keyset_filter(pagination.encode_cursor(event))
+
+    assert query_filter == {
+        "$or": [
+            {"timestamp": {"$lt": event["timestamp"]}},
+            {"timestamp": event["timestamp"], "_id": {"$lt": event["_id"]}},
+        ]
+    }
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", "eyJ0IjoxfQ"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(pagination.InvalidCursor):
+        pagination.decode_cursor(cursor)
+
+
+
+@pytest.mark.parametrize("timestamp", ["1e20", "-1e20", "1e400"])
+def test_out_of_range_cursor(timestamp):
+    cursor_json = f'{{"t":{timestamp},"id":"{ObjectId()}"}}'.encode()
+
+    with pytest.raises(pagination.InvalidCursor):
+        pagination.decode_cursor(base64.urlsafe_b64encode(cursor_json).decode())
@@ -0,0 +1,28 @@
+import pytest
+
+from products.command_center import projections
+
+
+def test_parse_fields_includes():
+    assert projections.parse_fields("event_name, src_ip,file.file_name") == {"event_name": 1, "file.file_name": 1,
+                                                                              "src_ip": 1}
+
+
+def test_parse_fields_formatted_timestamp_needs_timestamp():
+    assert projections.parse_fields("formatted_timestamp") == {"formatted_timestamp": 1, "timestamp": 1}
+
+
+def test_parse_fields_excludes():
+    assert projections.parse_fields("-computer,-file", allow_exclusion=True) == {"computer": 0, "file": 0}
+
+
+@pytest.mark.parametrize("fields, allow_exclusion", [
+    ("update_seq", False),
+    ("file.$where", False),
+    ("-file", False),
+    ("event_name,-file", True),
+    (" , ", False),
+])
+def test_parse_fields_invalid(fields, allow_exclusion):
+    with pytest.raises(projections.InvalidProjection):
+        projections.parse_fields(fields, allow_exclusion=allow_exclusion)
@@ -0,0 +1,126 @@
+import asyncio
+
+from datetime import datetime
+
+from products.command_center import rollups
+
+
+class FakeCursor(object):
+
+    def __init__(self, results):
+        self.results = iter(results)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.results)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection(object):
+
+    def __init__(self, results):
+        self.results = results
+        self.pipelines = []
+
+    def aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        return FakeCursor(self.results)
+
+
+def test_bucket_start():
+    assert rollups.bucket_start(datetime(2020, 5, 1, 12, 34, 56, 789000)) == datetime(2020, 5, 1, 12, 30)
+    assert rollups.bucket_start(datetime(2020, 5, 1, 12, 35)) == datetime(2020, 5, 1, 12, 35)
+
+
+def test_get_event_counts_merges_rollups_and_raw_events():
+    first_bucket = datetime(2020, 5, 1, 12, 5)
+    second_bucket = datetime(2020, 5, 1, 12, 10)
+
+    command_center_db = {
+        "event_rollups": FakeCollection([{"_id": {"bucket": second_bucket}, "count": 3}]),
+        "events": FakeCollection([{"_id": {"bucket": first_bucket}, "count": 1},
+                                  {"_id": {"bucket": second_bucket}, "count": 2}]),
+    }
+
+    start = datetime(2020, 5, 1, 12, 7)
+    event_counts = asyncio.run(rollups.get_event_counts(command_center_db, start, {"product": {"$eq": "Umbrella"}}))
+
+    assert event_counts == [{"_id": first_bucket, "count": 1}, {"_id": second_bucket, "count": 5}]
+
+    # Only complete buckets are read from the rollups
+    rollup_match = command_center_db["event_rollups"].pipelines[0][0]["$match"]
+    assert rollup_match["product"] == {"$eq": "Umbrella"}
+    assert rollup_match["bucket"]["$gte"] == second_bucket
+
+    # The partial first bucket is counted from the raw events
+    raw_match = command_center_db["events"].pipelines[0][0]["$match"]
+    assert raw_match["$or"][0] == {"timestamp": {"$gte": start, "$lt": second_bucket}}
+
+
+def test_get_event_counts_grouped_into_series():
+    bucket = datetime(2020, 5, 1, 12, 0)
+
+    command_center_db = {
+        "event_rollups": FakeCollection([{"_id": {"bucket": bucket, "series": "Umbrella"}, "count": 3},
+                                         {"_id": {"bucket": bucket, "series": "Stealthwatch"}, "count": 4}]),
+        "events": FakeCollection([{"_id": {"bucket": bucket, "series": "Umbrella"}, "count": 1}]),
+    }
+
+    event_counts = asyncio.run(rollups.get_event_counts(command_center_db, datetime(2020, 5, 1), granularity=60,
+                                                        group_by="product"))
+
+    assert sorted(event_counts, key=lambda event_count: event_count["series"]) == [
+        {"_id": bucket, "count": 4, "series": "Stealthwatch"},
+        {"_id": bucket, "count": 4, "series": "Umbrella"},
+    ]
+
+    # Both passes bucket by the requested granularity, and group by the product
+    group_key = command_center_db["event_rollups"].pipelines[0][1]["$group"]["_id"]
+    assert group_key["bucket"]["$dateTrunc"]["binSize"] == 60
+    assert group_key["series"] == "$product"
+
+
+def test_get_granularity():
+    assert rollups.get_granularity(24) == 5
+    assert rollups.get_granularity(48) == 15
+    assert rollups.get_granularity(720) == 240
+    assert rollups.get_granularity(None) == 240
+
+
+class FakeAggregateCursor(object):
+
+    async def to_list(self, length=None):
+        return []
+
+
+class FakeMigrations(object):
+
+    def __init__(self):
+        self.documents = {}
+
+    async def find_one(self, query):
+        return self.documents.get(query["_id"])
+
+    async def update_one(self, query, update, upsert=False):
+        self.documents.setdefault(query["_id"], {"_id": query["_id"]}).update(update["$set"])
+
+
+class FakeEvents(object):
+
+    def aggregate(self, pipeline, **kwargs):
+        return FakeAggregateCursor()
+
+
+def test_backfill_records_marker():
+    command_center_db = {"events": FakeEvents(), "migrations": FakeMigrations()}
+
+    async def run():
+        assert not await rollups.is_backfilled(command_center_db)
+        await rollups.backfill(command_center_db)
+        assert await rollups.is_backfilled(command_center_db)
+
+    asyncio.run(run())
@@ -0,0 +1,34 @@
+from products.command_center import index_manager, storage
+
+
+def test_timeseries_indexes_replace_ttl_index_with_id_index():
+    names = [index.document["name"] for index in storage.get_event_indexes(storage.TIMESERIES)]
+
+    assert "timestamp_1" not in names
+    assert "event_text" not in names
+    assert "_id_1" in names
+    assert storage.get_event_indexes(storage.STANDARD) is index_manager.EVENT_INDEXES
+
+
+def test_add_meta():
+    event = storage.add_meta({"product": "Umbrella", "src_ip": "10.0.0.1", "event_name": "Umbrella Blocked"})
+
+    assert event["meta"] == {"product": "Umbrella", "src_ip": "10.0.0.1"}
+
+
+def test_timeseries_event_key_index_is_not_unique():
+    indexes = {index.document["name"]: index.document for index in storage.get_event_indexes(storage.TIMESERIES)}
+    standard_indexes = {index.document["name"]: index.document for index in index_manager.EVENT_INDEXES}
+
+    assert standard_indexes["event_key_1"]["unique"]
+    assert not indexes["event_key_1"].get("unique")
+
+
+def test_timeseries_filters_query_meta():
+    query_filter = {"product": {"$eq": "Umbrella"}, "event_name": {"$eq": "Umbrella Blocked"},
+                    "$or": [{"src_ip": "10.0.0.1"}, {"src_ip_num": {"$gte": 167772160}}]}
+
+    assert storage.to_storage_filter(query_filter, storage.TIMESERIES) == {
+        "meta.product": {"$eq": "Umbrella"}, "event_name": {"$eq": "Umbrella Blocked"},
+        "$or": [{"meta.src_ip": "10.0.0.1"}, {"src_ip_num": {"$gte": 167772160}}]}
+    assert storage.to_storage_filter(query_filter, storage.STANDARD) is query_filter
@@ -0,0 +1,65 @@
+import asyncio
+
+from products.command_center import summary
+
+
+class FakeCursor(object):
+
+    def __init__(self, results):
+        self.results = results
+
+    async def to_list(self, length=None):
+        return self.results
+
+
+class FakeCollection(object):
+
+    def __init__(self, facets, estimated_count=0):
+        self.facets = facets
+        self.estimated_count = estimated_count
+        self.pipelines = []
+
+    def aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        return FakeCursor([self.facets])
+
+    async def estimated_document_count(self):
+        return self.estimated_count
+
+
+FACETS = {
+    "total": [{"count": 3}],
+    "products": [{"_id": "Umbrella", "count": 2}, {"_id": "Stealthwatch", "count": 1}],
+    "event_names": [{"_id": "Umbrella Blocked Destination", "count": 2}, {"_id": "Port Scan", "count": 1}],
+    "src_ips": [{"_id": "10.0.0.1", "count": 3}],
+}
+
+
+def test_build_pipeline_limits_top_facets():
+    pipeline = summary.build_pipeline({"product": {"$eq": "Umbrella"}}, top=5)
+
+    assert pipeline[0] == {"$match": {"product": {"$eq": "Umbrella"}}}
+    assert pipeline[1]["$facet"]["total"] == [{"$count": "count"}]
+    assert pipeline[1]["$facet"]["products"] == [{"$sortByCount": "$product"}]
+    assert pipeline[1]["$facet"]["src_ips"] == [{"$sortByCount": "$src_ip"}, {"$limit": 5}]
+
+
+def test_get_summary():
+    events = FakeCollection(FACETS)
+
+    result = asyncio.run(summary.get_summary(events, {"product": {"$eq": "Umbrella"}}, fast_totals=True))
+
+    assert result["total"] == 3
+    assert not result["total_estimated"]
+    assert result["products"] == [{"name": "Umbrella", "count": 2}, {"name": "Stealthwatch", "count": 1}]
+    assert result["src_ips"] == [{"name": "10.0.0.1", "count": 3}]
+
+
+def test_get_summary_fast_totals_for_unfiltered_queries():
+    events = FakeCollection({**FACETS, "total": []}, estimated_count=1000)
+
+    result = asyncio.run(summary.get_summary(events, {}, fast_totals=True))
+
+    assert "total" not in events.pipelines[0][1]["$facet"]
+    assert result["total"] == 1000
+    assert result["total_estimated"]
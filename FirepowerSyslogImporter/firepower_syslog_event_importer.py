@@ -5,6 +5,8 @@
 This module is used to import Firepower syslog events into Cisco Command Center
 """
 
+import hashlib
+import ipaddress
 import json
 import os
 import re
@@ -12,11 +14,19 @@ import socketserver
 
 import pymongo
 
+from bson.binary import Binary
 from datetime import datetime
 from dotenv import load_dotenv
+from pymongo.errors import DuplicateKeyError
 
 load_dotenv()
 
+# The size of each event rollup bucket, which must match the API Relay
+ROLLUP_BUCKET_MINUTES = 5
+
+# The fields the idempotency key of a Firepower event is derived from: the sensor, Snort rule, tuple and time
+EVENT_KEY_FIELDS = ["sensor_name", "snort_id", "protocol", "src_ip", "src_port", "dst_ip", "dst_port", "timestamp"]
+
 
 class FirepowerSyslogHandler():
     """
@@ -75,11 +85,38 @@ class FirepowerSyslogHandler():
                 "dst_geo": parsed_event.group(16),
             }
 
+            # Store the source IP as a number too, for CIDR range queries
+            event_json["src_ip_num"] = self._get_ip_number(event_json["src_ip"])
+
+            # Key the event by its source, so that a resent syslog message isn't stored twice
+            event_json["event_key"] = self._get_event_key(event_json)
+
             return event_json
 
         else:
             return None
 
+    def _get_ip_number(self, address):
+        """
+        Convert an IP address into a number for range queries (an integer for IPv4, or binary for IPv6).
+        """
+
+        try:
+            address = ipaddress.ip_address(address)
+        except (TypeError, ValueError):
+            return None
+
+        return int(address) if address.version == 4 else Binary(address.packed)
+
+    def _get_event_key(self, event_json):
+        """
+        Get the idempotency key of a Firepower event, a hash of the fields that identify it.
+        """
+
+        key_fields = json.dumps([event_json[field] for field in EVENT_KEY_FIELDS], default=str)
+
+        return hashlib.sha1(key_fields.encode()).hexdigest()
+
     def _commit_to_db(self, event_json):
         """
         Commit the provided Event JSON to the database.
@@ -96,11 +133,56 @@ class FirepowerSyslogHandler():
         # Use the 'events' collection from the 'commandcenter' database
         command_center_events = command_center_db["events"]
 
-        # Store the event in the database
-        db_record = command_center_events.insert_one(event_json)
+        # Time series collections can't have unique indexes, so look for the event instead
+        if os.getenv("EVENTS_STORAGE_MODE") == "timeseries" and \
+                command_center_events.find_one({"event_key": event_json["event_key"]}, {"_id": 1}):
+            print(f"Skipped Firepower event {event_json['event_key']}, which is already stored")
+            return
+
+        # Stamp the event with the next update sequence, so that it's picked up by the API Relay's next sync
+        counter = command_center_db["counters"].find_one_and_update({"_id": "events"}, {"$inc": {"seq": 1}},
+                                                                     upsert=True,
+                                                                     return_document=pymongo.ReturnDocument.AFTER)
+
+        event_json["insert_seq"] = event_json["update_seq"] = counter["seq"]
+        event_json["updated_at"] = datetime.utcnow()
+
+        # Time series collections group events into buckets by their 'meta' field
+        if os.getenv("EVENTS_STORAGE_MODE") == "timeseries":
+            event_json["meta"] = {"product": event_json["product"], "src_ip": event_json["src_ip"]}
+
+        # Store the event in the database, unless the unique index shows it's already stored
+        try:
+            db_record = command_center_events.insert_one(event_json)
+        except DuplicateKeyError:
+            print(f"Skipped Firepower event {event_json['event_key']}, which is already stored")
+            return
 
         print(f"Inserted Firepower event at MongoDB ID {db_record.inserted_id}")
 
+        # Update the event counts
+        self._update_rollup(command_center_db["event_rollups"], event_json)
+
+    def _update_rollup(self, rollup_table, event_json):
+        """
+        Increment the event count for the provided Event JSON's rollup bucket.
+        """
+
+        timestamp = event_json["timestamp"]
+
+        rollup_fields = {
+            "bucket": timestamp.replace(minute=timestamp.minute - timestamp.minute % ROLLUP_BUCKET_MINUTES,
+                                        second=0, microsecond=0),
+            "product": event_json["product"],
+            "event_name": event_json["event_name"],
+            "src_ip": event_json["src_ip"],
+        }
+
+        rollup_table.update_one({"_id": rollup_fields},
+                                {"$inc": {"count": 1},
+                                 "$setOnInsert": {**rollup_fields, "src_ip_num": event_json.get("src_ip_num")}},
+                                upsert=True)
+
 
 class SyslogHandler(socketserver.BaseRequestHandler):
     """
@@ -4,6 +4,50 @@ import axios from 'axios';
 
 Vue.use(Vuex);
 
+// The most pages of events to fetch for the event table, so a busy timeframe isn't downloaded in full
+const MAX_EVENT_PAGES = 5;
+
+// Counts the requests for events, so that the pages of an older request are dropped
+let eventsRequest = 0;
+
+const MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'];
+
+// Format a date the same way the API Relay does, e.g. 'May 01, 2020 12:30:15 UTC'
+function formatTimestamp(date) {
+  const pad = (value) => `${value}`.padStart(2, '0');
+
+  return `${MONTHS[date.getUTCMonth()]} ${pad(date.getUTCDate())}, ${date.getUTCFullYear()} `
+    + `${pad(date.getUTCHours())}:${pad(date.getUTCMinutes())}:${pad(date.getUTCSeconds())} UTC`;
+}
+
+// Rebuild the events from a columnar page, in the same shape as the default format
+function fromColumns(page) {
+  const { columns } = page;
+  const events = [];
+
+  for (let i = 0; i < page.count; i += 1) {
+    const event = { _id: { $oid: columns._id[i] } };
+
+    Object.keys(columns).forEach((field) => {
+      const column = columns[field];
+
+      if (field === '_id') return;
+      if (field === 'timestamp') {
+        event.timestamp = { $date: column[i] };
+        event.formatted_timestamp = formatTimestamp(new Date(column[i]));
+      } else if (column.dictionary) {
+        event[field] = column.dictionary[column.indexes[i]];
+      } else {
+        event[field] = column[i];
+      }
+    });
+
+    events.push(event);
+  }
+
+  return events;
+}
+
 export default new Vuex.Store({
   state: {
     errors: [],
@@ -62,13 +106,41 @@ export default new Vuex.Store({
       context.commit('SET_LOADING_STATUS', true);
 
       // Get the event data
-      let path = `/api/command-center/events?timeframe=${this.state.timeframe}`;
+      let path = `/api/command-center/events?timeframe=${this.state.timeframe}&format=columnar`;
       if (hostIp) path = `${path}&host_ip=${encodeURIComponent(hostIp)}`;
-      console.log(path);
-      axios.get(path, { timeout: 60000 })
-        .then((res) => {
-          context.commit('SET_EVENTS', res.data.events);
-          context.commit('SET_LOADING_STATUS', false);
+
+      eventsRequest += 1;
+      const request = eventsRequest;
+
+      // Follow the cursor for up to MAX_EVENT_PAGES pages
+      const events = [];
+      const getPage = (cursor, pageCount) => {
+        const pagePath = cursor ? `${path}&cursor=${encodeURIComponent(cursor)}` : path;
+        console.log(pagePath);
+        return axios.get(pagePath, { timeout: 60000 })
+          .then((res) => {
+            if (request !== eventsRequest) return null;
+            events.push(...fromColumns(res.data));
+
+            // Show the first page straight away, while the rest are fetched
+            if (pageCount === 1) {
+              context.commit('SET_EVENTS', events.slice());
+              context.commit('SET_LOADING_STATUS', false);
+            }
+
+            if (res.data.next_cursor && pageCount < MAX_EVENT_PAGES) {
+              return getPage(res.data.next_cursor, pageCount + 1);
+            }
+            return events;
+          });
+      };
+
+      getPage(null, 1)
+        .then((allEvents) => {
+          // Add the rest of the pages, if there were any
+          if (allEvents && allEvents.length > this.state.events.length) {
+            context.commit('SET_EVENTS', allEvents);
+          }
         })
         .catch((error) => {
           console.error(error);
@@ -5,6 +5,8 @@
 This module is used to import Cisco Stealthwatch events into Cisco Command Center
 """
 
+import hashlib
+import ipaddress
 import json
 import os
 import time
@@ -12,8 +14,11 @@ import time
 import pymongo
 import requests
 
+from bson.binary import Binary
+from collections import Counter
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from pymongo.errors import BulkWriteError
 from requests.auth import HTTPBasicAuth
 from requests.packages import urllib3
 
@@ -153,28 +158,215 @@ def get_events(start_date=None, end_date=None):
         exit(1)
 
 
-def get_existing_event(event_table, event):
-    """A function to search the database for an existing active event"""
+# The fields that identify a Stealthwatch event, which stay the same as it's updated while it's active
+EVENT_KEY_FIELDS = ["firstActiveTime", "securityEventType", "source", "target"]
 
-    # Set up a query to look for an identical active event
-    active_event_query = {
-        "id": 0,
-        "product": "Stealthwatch",
-        "firstActiveTime": event["firstActiveTime"],
-        "securityEventType": event["securityEventType"],
-        "source": event["source"],
-        "target": event["target"]
+# The error code MongoDB returns when a write violates a unique index
+DUPLICATE_KEY_ERROR = 11000
+
+
+def get_event_key(event):
+    """Get the natural key of a Stealthwatch event, a hash of the fields that identify it"""
+
+    key_fields = json.dumps([event[field] for field in EVENT_KEY_FIELDS], sort_keys=True, default=str)
+
+    return hashlib.sha1(key_fields.encode()).hexdigest()
+
+
+# The size of each event rollup bucket, which must match the API Relay
+ROLLUP_BUCKET_MINUTES = 5
+
+
+def get_rollup_key(event):
+    """Get the rollup key (bucket, product, event name and source IP) for an event"""
+
+    timestamp = event["timestamp"]
+    bucket = timestamp.replace(minute=timestamp.minute - timestamp.minute % ROLLUP_BUCKET_MINUTES,
+                               second=0, microsecond=0)
+
+    return (bucket, event["product"], event["event_name"], event["src_ip"])
+
+
+def get_ip_number(address):
+    """Convert an IP address into a number for range queries (an integer for IPv4, or binary for IPv6)"""
+
+    try:
+        address = ipaddress.ip_address(address)
+    except (TypeError, ValueError):
+        return None
+
+    return int(address) if address.version == 4 else Binary(address.packed)
+
+
+def update_rollups(rollup_table, rollup_counts):
+    """Apply a batch of event count changes to the event rollups"""
+
+    operations = []
+
+    for ((bucket, product, event_name, src_ip), count) in rollup_counts.items():
+
+        # Skip keys whose changes cancelled each other out
+        if not count:
+            continue
+
+        rollup_fields = {"bucket": bucket, "product": product, "event_name": event_name, "src_ip": src_ip}
+
+        operations.append(pymongo.UpdateOne({"_id": rollup_fields},
+                                            {"$inc": {"count": count},
+                                             "$setOnInsert": {**rollup_fields, "src_ip_num": get_ip_number(src_ip)}},
+                                            upsert=True))
+
+    if operations:
+        rollup_table.bulk_write(operations, ordered=False)
+
+
+def allocate_sequences(counter_table, count=1):
+    """Reserve a block of update sequence numbers, used by the API Relay to sync changes, and return the first"""
+
+    counter = counter_table.find_one_and_update({"_id": "events"}, {"$inc": {"seq": count}}, upsert=True,
+                                                return_document=pymongo.ReturnDocument.AFTER)
+
+    return counter["seq"] - count + 1
+
+
+def stamp_sequence(event, seq, insert_seq=None):
+    """Stamp an event with the update sequence of the write that stores it"""
+
+    event["insert_seq"] = seq if insert_seq is None else insert_seq
+    event["update_seq"] = seq
+    event["updated_at"] = datetime.utcnow()
+
+
+def ensure_indexes(event_table, state_table, source):
+    """Ensure the indexes used to find the latest event for a product, and events by their natural key, exist"""
+
+    # Matches the 'product_1_timestamp_-1' index managed by the API Relay
+    event_table.create_index([("product", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)],
+                             name="product_1_timestamp_-1")
+
+    # Matches the 'event_key_1' index managed by the API Relay.  Time series collections can't have unique indexes.
+    if os.getenv("EVENTS_STORAGE_MODE") == "timeseries":
+        event_table.create_index([("event_key", pymongo.ASCENDING)], name="event_key_1")
+    else:
+        event_table.create_index([("event_key", pymongo.ASCENDING)], name="event_key_1", unique=True,
+                                 partialFilterExpression={"event_key": {"$exists": True}})
+
+    # Key the events stored before the natural key existed, now that the unique index rejects duplicates.
+    # This scans all of the product's events, so it's only done once.
+    if not (state_table.find_one({"_id": source}) or {}).get("event_keys_backfilled"):
+        backfill_event_keys(event_table)
+        state_table.update_one({"_id": source}, {"$set": {"event_keys_backfilled": True}}, upsert=True)
+
+
+def backfill_event_keys(event_table):
+    """Add the natural key to the Stealthwatch events stored before it existed"""
+
+    legacy_events = event_table.find({"product": "Stealthwatch", "event_key": {"$exists": False}},
+                                     {field: 1 for field in EVENT_KEY_FIELDS})
+
+    operations = [pymongo.UpdateOne({"_id": event["_id"]}, {"$set": {"event_key": get_event_key(event)}})
+                  for event in legacy_events]
+
+    if not operations:
+        return
+
+    try:
+        result = event_table.bulk_write(operations, ordered=False)
+        print(f"Added the natural key to {result.modified_count} Stealthwatch events")
+
+    # Older duplicates of an event are left without a key, and expire with the rest of the old events
+    except BulkWriteError as error:
+        if any(write_error["code"] != DUPLICATE_KEY_ERROR for write_error in error.details["writeErrors"]):
+            raise
+
+        print(f"Added the natural key to {error.details['nModified']} Stealthwatch events, "
+              f"skipping {len(error.details['writeErrors'])} duplicates")
+
+
+def store_events(event_table, counter_table, rollup_table, events):
+    """Upsert a batch of events by their natural key with a single bulk write, and update their event counts.
+
+    Returns the number of events inserted, and the number updated.
+    """
+
+    # Get the stored versions of the events in one indexed query, for their event counts and insert sequences
+    existing_events = {
+        existing_event["event_key"]: existing_event
+        for existing_event in event_table.find({"event_key": {"$in": [event["event_key"] for event in events]}},
+                                               ["event_key", "insert_seq", "timestamp", "product", "event_name",
+                                                "src_ip"])
     }
 
-    # Get the event
-    event = event_table.find_one(active_event_query)
+    # Events re-fetched in the overlap window without any new activity are left as they are
+    events = [event for event in events
+              if event["event_key"] not in existing_events
+              or existing_events[event["event_key"]]["timestamp"] < event["timestamp"]]
+
+    if not events:
+        return (0, 0)
+
+    # Reserve a sequence number for each event in one round trip
+    first_seq = allocate_sequences(counter_table, len(events))
+
+    rollup_counts = Counter()
+    operations = []
+
+    for (offset, event) in enumerate(events):
+        existing_event = existing_events.get(event["event_key"])
+
+        if existing_event:
+
+            # Stamp the event so that it's picked up by the next sync as an update
+            stamp_sequence(event, first_seq + offset, insert_seq=existing_event.get("insert_seq", 0))
+
+            # The updated event may have moved to a different bucket
+            rollup_counts[get_rollup_key(existing_event)] -= 1
+
+        else:
+            stamp_sequence(event, first_seq + offset)
+
+        rollup_counts[get_rollup_key(event)] += 1
+
+        operations.append(pymongo.ReplaceOne({"event_key": event["event_key"]}, event, upsert=True))
+
+    result = event_table.bulk_write(operations, ordered=False)
 
-    return event
+    update_rollups(rollup_table, rollup_counts)
+
+    print(f"Stored a batch of Stealthwatch events: {result.upserted_count} inserted, {result.matched_count} updated")
+
+    return (result.upserted_count, result.matched_count)
+
+
+def get_checkpoint(state_table, event_table, source):
+    """Get the importer checkpoint for a source, seeding its watermark from the latest stored event the first time"""
+
+    checkpoint = state_table.find_one({"_id": source})
+
+    if checkpoint and "watermark" in checkpoint:
+        return checkpoint
+
+    # Before checkpoints were stored, the importers resumed from the latest stored event
+    latest_event = event_table.find_one({"product": source}, sort=[("timestamp", pymongo.DESCENDING)])
+
+    return {"_id": source, "watermark": latest_event["timestamp"] if latest_event else None}
+
+
+def save_checkpoint(state_table, source, watermark, run_stats):
+    """Save the watermark and statistics of an import run in a single atomic update"""
+
+    state_table.update_one({"_id": source},
+                           {"$max": {"watermark": watermark},
+                            "$set": {"last_run": run_stats, "updated_at": datetime.utcnow()},
+                            "$inc": {"total_inserted": run_stats["inserted"], "total_updated": run_stats["updated"]}},
+                           upsert=True)
 
 
 def run():
     """Main function to get new Stealthwatch events and commit them to the MongoDB database"""
 
+    run_started_at = datetime.utcnow()
+
     # Connect to the MongoDB instance
     db_client = pymongo.MongoClient(f"mongodb://{os.getenv('MONGO_INITDB_ADDRESS')}/",
                                     username=os.getenv("MONGO_INITDB_ROOT_USERNAME"),
@@ -186,18 +378,32 @@ def run():
     # Use the 'events' collection from the 'commandcenter' database
     command_center_events = command_center_db["events"]
 
-    # Get the latest 'Stealthwatch' event
-    latest_event = command_center_events.find({"product": "Stealthwatch"}).sort("timestamp", -1)
+    # Use the 'event_rollups' collection to keep event counts up to date
+    command_center_rollups = command_center_db["event_rollups"]
+
+    # Use the 'counters' collection to allocate update sequences
+    command_center_counters = command_center_db["counters"]
+
+    # Use the 'importer_state' collection to keep track of where each import left off
+    command_center_importer_state = command_center_db["importer_state"]
+
+    # Make sure the latest event and natural key lookups are index scans
+    ensure_indexes(command_center_events, command_center_importer_state, "Stealthwatch")
 
-    # If there's no latest event, the Event collection is empty, so we create a timestamp to import from.
-    if latest_event.count():
-        latest_event = latest_event[0]
+    # Get the checkpoint of the last import
+    checkpoint = get_checkpoint(command_center_importer_state, command_center_events, "Stealthwatch")
+
+    # If there's no watermark, nothing has been imported yet, so we create a timestamp to import from.
+    if checkpoint["watermark"]:
+        # Re-fetch a window before the watermark, since the events that haven't changed since are skipped
+        overlap = timedelta(seconds=int(os.getenv("IMPORT_OVERLAP_SECONDS", 300)))
+        latest_event = {"timestamp": checkpoint["watermark"] - overlap}
     else:
         print("No events in database.  Setting latest_event timestamp to 1 days ago.")
         start_date = datetime.utcnow().replace(microsecond=0) + timedelta(-1)
         latest_event = {"timestamp": start_date}
 
-    print("Latest Stealtwatch Event: ", latest_event["timestamp"])
+    print("Importing Stealthwatch events from: ", latest_event["timestamp"])
 
     # Log in to Stealtwatch
     login()
@@ -210,6 +416,14 @@ def run():
 
     print("Total Events Returned: ", len(stealthwatch_events["data"]["results"]))
 
+    # The events to store, by their natural key
+    events = {}
+
+    # Keep track of the newest event imported, and the number of events
+    newest_event_time = None
+    run_stats = {"started_at": run_started_at, "fetched": len(stealthwatch_events["data"]["results"]),
+                 "inserted": 0, "updated": 0}
+
     # Iterate through all fetched events
     for event in stealthwatch_events["data"]["results"]:
 
@@ -220,13 +434,10 @@ def run():
         if event["securityEventType"] in [262, 292, 310]:
             continue
 
-        # Check to see if there's an existing active event
-        existing_event = get_existing_event(command_center_events, event)
-
         current_event_time = datetime.strptime(event["lastActiveTime"], "%Y-%m-%dT%H:%M:%S.%f+0000")
         latest_event_time = latest_event["timestamp"]
 
-        if current_event_time > latest_event_time:
+        if current_event_time >= latest_event_time:
 
             # Make common fields for the event
             (event["event_name"], event["event_details"]) = event_names[event["securityEventType"]]
@@ -241,19 +452,27 @@ def run():
             # Add the common fields to the event
             event.update(event_common_fields)
 
-            if existing_event:
+            # Store the source IP as a number too, for CIDR range queries
+            event["src_ip_num"] = get_ip_number(event["src_ip"])
 
-                # Update the event in the database
-                x = command_center_events.replace_one({"_id": existing_event["_id"]}, event)
+            # Time series collections group events into buckets by their 'meta' field
+            if os.getenv("EVENTS_STORAGE_MODE") == "timeseries":
+                event["meta"] = {"product": event["product"], "src_ip": event["src_ip"]}
 
-                print(f"Updated Stealthwatch Event ID {event['id']} at MongoDB ID {existing_event['_id']}")
+            # Keep the last version of an event that's returned more than once
+            event["event_key"] = get_event_key(event)
+            events[event["event_key"]] = event
 
-            else:
+            newest_event_time = max(newest_event_time or current_event_time, current_event_time)
 
-                # Store the event in the database
-                x = command_center_events.insert_one(event)
+    # Insert the new events, and replace the updated ones
+    if events:
+        (run_stats["inserted"], run_stats["updated"]) = store_events(command_center_events, command_center_counters,
+                                                                     command_center_rollups, list(events.values()))
 
-                print(f"Inserted Stealthwatch Event ID {event['id']} at MongoDB ID {x.inserted_id}")
+    # Move the watermark up to the newest event, now that the events are stored
+    run_stats["finished_at"] = datetime.utcnow()
+    save_checkpoint(command_center_importer_state, "Stealthwatch", newest_event_time, run_stats)
 
 ###################
 # !!! DO WORK !!! #
@@ -5,6 +5,8 @@
 This script is used to import Cisco Umbrella events into Cisco Command Center
 """
 
+import hashlib
+import ipaddress
 import json
 import os
 import time
@@ -12,8 +14,12 @@ import time
 import pymongo
 import requests
 
+from bson.binary import Binary
+from collections import Counter
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
 from requests.auth import HTTPBasicAuth
 
 load_dotenv()
@@ -41,9 +47,223 @@ def get_events(start_date=None):
         exit(1)
 
 
+# The size of each event rollup bucket, which must match the API Relay
+ROLLUP_BUCKET_MINUTES = 5
+
+# The request fields the idempotency key of an Umbrella event is derived from, since requests don't have an ID
+EVENT_KEY_FIELDS = ["datetime", "originId", "originType", "originLabel", "internalIp", "externalIp", "destination",
+                    "actionTaken", "categories", "tags"]
+
+# The error code MongoDB returns when a write violates a unique index
+DUPLICATE_KEY_ERROR = 11000
+
+
+def get_event_key(event, occurrence=0):
+    """Get the idempotency key of an Umbrella event, a hash of the request fields that identify it.
+
+    Requests with identical fields, like retries in the same instant, are separate activity, so each is told apart
+    by its 'occurrence', its position among the identical requests.
+    """
+
+    key_fields = json.dumps([event.get(field) for field in EVENT_KEY_FIELDS] + [occurrence], sort_keys=True,
+                            default=str)
+
+    return hashlib.sha1(key_fields.encode()).hexdigest()
+
+
+def get_rollup_key(event):
+    """Get the rollup key (bucket, product, event name and source IP) for an event"""
+
+    timestamp = event["timestamp"]
+    bucket = timestamp.replace(minute=timestamp.minute - timestamp.minute % ROLLUP_BUCKET_MINUTES,
+                               second=0, microsecond=0)
+
+    return (bucket, event["product"], event["event_name"], event["src_ip"])
+
+
+def get_ip_number(address):
+    """Convert an IP address into a number for range queries (an integer for IPv4, or binary for IPv6)"""
+
+    try:
+        address = ipaddress.ip_address(address)
+    except (TypeError, ValueError):
+        return None
+
+    return int(address) if address.version == 4 else Binary(address.packed)
+
+
+def update_rollups(rollup_table, rollup_counts):
+    """Apply a batch of event count changes to the event rollups"""
+
+    operations = []
+
+    for ((bucket, product, event_name, src_ip), count) in rollup_counts.items():
+
+        # Skip keys whose changes cancelled each other out
+        if not count:
+            continue
+
+        rollup_fields = {"bucket": bucket, "product": product, "event_name": event_name, "src_ip": src_ip}
+
+        operations.append(pymongo.UpdateOne({"_id": rollup_fields},
+                                            {"$inc": {"count": count},
+                                             "$setOnInsert": {**rollup_fields, "src_ip_num": get_ip_number(src_ip)}},
+                                            upsert=True))
+
+    if operations:
+        rollup_table.bulk_write(operations, ordered=False)
+
+
+def allocate_sequences(counter_table, count=1):
+    """Reserve a block of update sequence numbers, used by the API Relay to sync changes, and return the first"""
+
+    counter = counter_table.find_one_and_update({"_id": "events"}, {"$inc": {"seq": count}}, upsert=True,
+                                                return_document=pymongo.ReturnDocument.AFTER)
+
+    return counter["seq"] - count + 1
+
+
+def stamp_sequence(event, seq, insert_seq=None):
+    """Stamp an event with the update sequence of the write that stores it"""
+
+    event["insert_seq"] = seq if insert_seq is None else insert_seq
+    event["update_seq"] = seq
+    event["updated_at"] = datetime.utcnow()
+
+
+def ensure_indexes(event_table, state_table, source):
+    """Ensure the indexes used to find the latest event for a product, and events by their idempotency key, exist"""
+
+    # Matches the 'product_1_timestamp_-1' index managed by the API Relay
+    event_table.create_index([("product", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)],
+                             name="product_1_timestamp_-1")
+
+    # Matches the 'event_key_1' index managed by the API Relay.  Time series collections can't have unique indexes.
+    if os.getenv("EVENTS_STORAGE_MODE") == "timeseries":
+        event_table.create_index([("event_key", pymongo.ASCENDING)], name="event_key_1")
+    else:
+        event_table.create_index([("event_key", pymongo.ASCENDING)], name="event_key_1", unique=True,
+                                 partialFilterExpression={"event_key": {"$exists": True}})
+
+    # Key the events stored before the idempotency key existed, now that the unique index rejects duplicates.
+    # This scans all of the product's events, so it's only done once.
+    if not (state_table.find_one({"_id": source}) or {}).get("event_keys_backfilled"):
+        backfill_event_keys(event_table)
+        state_table.update_one({"_id": source}, {"$set": {"event_keys_backfilled": True}}, upsert=True)
+
+
+def backfill_event_keys(event_table):
+    """Add the idempotency key to the Umbrella events stored before it existed"""
+
+    legacy_events = event_table.find({"product": "Umbrella", "event_key": {"$exists": False}},
+                                     {field: 1 for field in EVENT_KEY_FIELDS}).sort("_id", pymongo.ASCENDING)
+
+    # Number identical requests in the order they were stored
+    occurrences = Counter()
+    operations = []
+
+    for event in legacy_events:
+        identity = get_event_key(event)
+
+        operations.append(pymongo.UpdateOne({"_id": event["_id"]},
+                                            {"$set": {"event_key": get_event_key(event, occurrences[identity])}}))
+
+        occurrences[identity] += 1
+
+    if not operations:
+        return
+
+    try:
+        result = event_table.bulk_write(operations, ordered=False)
+        print(f"Added the idempotency key to {result.modified_count} Umbrella events")
+
+    # Older duplicates of an event are left without a key, and expire with the rest of the old events
+    except BulkWriteError as error:
+        if any(write_error["code"] != DUPLICATE_KEY_ERROR for write_error in error.details["writeErrors"]):
+            raise
+
+        print(f"Added the idempotency key to {error.details['nModified']} Umbrella events, "
+              f"skipping {len(error.details['writeErrors'])} duplicates")
+
+
+def get_write_concern():
+    """Get the write concern for event imports, e.g. '1' to wait for the primary, or 'majority'"""
+
+    write_concern = os.getenv("IMPORT_WRITE_CONCERN", "1")
+
+    return WriteConcern(w=int(write_concern) if write_concern.isdigit() else write_concern)
+
+
+def store_events(event_table, counter_table, rollup_table, events):
+    """Store a batch of events with a single unordered insert, skipping the ones that are already stored.
+
+    Updates the event counts of the events stored, and returns the number stored.
+    """
+
+    # Time series collections can't have unique indexes, so leave out the events that are already stored instead
+    if os.getenv("EVENTS_STORAGE_MODE") == "timeseries":
+        stored_keys = set(event_table.distinct("event_key",
+                                               {"event_key": {"$in": [event["event_key"] for event in events]}}))
+        events = [event for event in events if event["event_key"] not in stored_keys]
+
+        if not events:
+            return 0
+
+    # Reserve a sequence number for each event in one round trip
+    first_seq = allocate_sequences(counter_table, len(events))
+
+    for (offset, event) in enumerate(events):
+        stamp_sequence(event, first_seq + offset)
+
+    try:
+        event_table.insert_many(events, ordered=False)
+        duplicates = set()
+
+    # The events re-fetched in the overlap window are already stored, so the unique index rejects them
+    except BulkWriteError as error:
+        if any(write_error["code"] != DUPLICATE_KEY_ERROR for write_error in error.details["writeErrors"]):
+            raise
+
+        duplicates = {write_error["index"] for write_error in error.details["writeErrors"]}
+
+    stored_events = [event for (index, event) in enumerate(events) if index not in duplicates]
+
+    update_rollups(rollup_table, Counter(get_rollup_key(event) for event in stored_events))
+
+    print(f"Stored a batch of {len(stored_events)} Umbrella events, skipping {len(duplicates)} already stored")
+
+    return len(stored_events)
+
+
+def get_checkpoint(state_table, event_table, source):
+    """Get the importer checkpoint for a source, seeding its watermark from the latest stored event the first time"""
+
+    checkpoint = state_table.find_one({"_id": source})
+
+    if checkpoint and "watermark" in checkpoint:
+        return checkpoint
+
+    # Before checkpoints were stored, the importers resumed from the latest stored event
+    latest_event = event_table.find_one({"product": source}, sort=[("timestamp", pymongo.DESCENDING)])
+
+    return {"_id": source, "watermark": latest_event["timestamp"] if latest_event else None}
+
+
+def save_checkpoint(state_table, source, watermark, run_stats):
+    """Save the watermark and statistics of an import run in a single atomic update"""
+
+    state_table.update_one({"_id": source},
+                           {"$max": {"watermark": watermark},
+                            "$set": {"last_run": run_stats, "updated_at": datetime.utcnow()},
+                            "$inc": {"total_inserted": run_stats["inserted"], "total_updated": run_stats["updated"]}},
+                           upsert=True)
+
+
 def run():
     """Main function to get new Umbrella events and commit them to the MongoDB database"""
 
+    run_started_at = datetime.utcnow()
+
     # Connect to the MongoDB instance
     db_client = pymongo.MongoClient(f"mongodb://{os.getenv('MONGO_INITDB_ADDRESS')}/",
                                     username=os.getenv("MONGO_INITDB_ROOT_USERNAME"),
@@ -52,35 +272,57 @@ def run():
     # Use the specified database
     command_center_db = db_client[os.getenv("MONGO_INITDB_DATABASE")]
 
-    # Use the 'events' collection from the specified database
-    command_center_events = command_center_db["events"]
+    # Use the 'events' collection from the specified database, with the configured write concern
+    command_center_events = command_center_db["events"].with_options(write_concern=get_write_concern())
+
+    # Use the 'event_rollups' collection to keep event counts up to date
+    command_center_rollups = command_center_db["event_rollups"]
 
-    # Get the count of Umbrella documents
-    event_count = command_center_events.count_documents({"product": "Umbrella"})
+    # Use the 'counters' collection to allocate update sequences
+    command_center_counters = command_center_db["counters"]
 
-    # If we have previous events, import from that point in time, otherwise, import the last day
-    if event_count:
+    # Use the 'importer_state' collection to keep track of where each import left off
+    command_center_importer_state = command_center_db["importer_state"]
 
-        # Get the latest 'Umbrella' event
-        latest_event = command_center_events.find({"product": "Umbrella"}).sort("timestamp", -1)
-        latest_event = latest_event[0]
+    # Make sure the latest event lookup is an index scan
+    ensure_indexes(command_center_events, command_center_importer_state, "Umbrella")
+
+    # Get the checkpoint of the last import
+    checkpoint = get_checkpoint(command_center_importer_state, command_center_events, "Umbrella")
+
+    # If we have imported events before, import from that point in time, otherwise, import the last day
+    if checkpoint["watermark"]:
+        # Re-fetch a window before the watermark, since the events that are already stored are skipped
+        overlap = timedelta(seconds=int(os.getenv("IMPORT_OVERLAP_SECONDS", 300)))
+        latest_event = {"timestamp": checkpoint["watermark"] - overlap}
     else:
         print("No events in database.  Setting latest_event timestamp to 24 hours ago. (The maximum for Umbrella)")
         start_date = datetime.utcnow().replace(microsecond=0) + timedelta(hours=-24)
         latest_event = {"timestamp": start_date}
 
-    print("Latest Umbrella Event: ", latest_event["timestamp"])
+    print("Importing Umbrella events from: ", latest_event["timestamp"])
 
     # Get the latest Umbrella events
     umbrella_events = get_events(latest_event["timestamp"])
 
+    # Events are stored in batches, rather than one at a time
+    batch_size = int(os.getenv("IMPORT_BATCH_SIZE", 1000))
+    batch = []
+
+    # The number of times each identical request has been seen
+    occurrences = Counter()
+
+    # Keep track of the newest event imported, and the number of events
+    newest_event_time = None
+    run_stats = {"started_at": run_started_at, "fetched": len(umbrella_events["requests"]), "inserted": 0, "updated": 0}
+
     # Iterate through all fetched events
     for event in umbrella_events["requests"]:
 
         current_event_time = datetime.strptime(event["datetime"], "%Y-%m-%dT%H:%M:%S.%fZ")
         latest_event_time = latest_event["timestamp"]
 
-        if current_event_time > latest_event_time:
+        if current_event_time >= latest_event_time:
 
             if event["internalIp"]:
                 src_ip = event["internalIp"]
@@ -100,10 +342,37 @@ def run():
             # Add the common fields to the event
             event.update(event_common_fields)
 
-            # Store the event in the database
-            x = command_center_events.insert_one(event)
+            # Store the source IP as a number too, for CIDR range queries
+            event["src_ip_num"] = get_ip_number(event["src_ip"])
+
+            # Time series collections group events into buckets by their 'meta' field
+            if os.getenv("EVENTS_STORAGE_MODE") == "timeseries":
+                event["meta"] = {"product": event["product"], "src_ip": event["src_ip"]}
+
+            # Key the event by its source, so that it's only stored once however many times it's fetched.  Identical
+            # requests are numbered, so that only the same request fetched again shares a key.
+            identity = get_event_key(event)
+            event["event_key"] = get_event_key(event, occurrences[identity])
+            occurrences[identity] += 1
+
+            batch.append(event)
+
+            newest_event_time = max(newest_event_time or current_event_time, current_event_time)
+
+            # Store the batch once it's full
+            if len(batch) >= batch_size:
+                run_stats["inserted"] += store_events(command_center_events, command_center_counters,
+                                                      command_center_rollups, batch)
+                batch = []
+
+    # Store the rest of the events
+    if batch:
+        run_stats["inserted"] += store_events(command_center_events, command_center_counters,
+                                              command_center_rollups, batch)
 
-            print(x.inserted_id)
+    # Move the watermark up to the newest event, now that the events are stored
+    run_stats["finished_at"] = datetime.utcnow()
+    save_checkpoint(command_center_importer_state, "Umbrella", newest_event_time, run_stats)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,15 @@
 let error = true;
 
-let result = [
-  db.events.createIndex({ timestamp: 1 }, { expireAfterSeconds: 2678400 })
-]
+let result = [];
+
+// Time series collections expire events themselves, and can't have a TTL index on their time field
+if (process.env.EVENTS_STORAGE_MODE === 'timeseries') {
+  result.push(db.createCollection('events', {
+    timeseries: { timeField: 'timestamp', metaField: 'meta', granularity: 'minutes' },
+    expireAfterSeconds: 2678400,
+  }));
+} else {
+  result.push(db.events.createIndex({ timestamp: 1 }, { expireAfterSeconds: 2678400 }));
+}
 
 printjson(result);